@@ -0,0 +1,501 @@
+############
+## IMPORTS ####################################################################
+# Benchmark covid19_data_gather.py against synthetic NYT data -- offline, no git remote, no Outlook.
+#
+# $ python ./covid19_benchmark.py                            # 1x, 10x, 100x
+# $ python ./covid19_benchmark.py --scales 1,10 --output bench.json
+# $ python ./covid19_benchmark.py --scales 1 --counties 500 --engine object
+# $ python ./covid19_benchmark.py --import-only                # exit 1 if over the import budget
+# $ python ./covid19_benchmark.py --sync-only                  # NYT git sync vs a local bare repo, exit 1 on failure
+#
+from pathlib import Path
+import sys
+import os
+import io
+import gc
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+import contextlib
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import covid19_data_gather as gdg
+
+############
+## GLOBALS ####################################################################
+g_bench_version = 1
+g_py_path = Path(__file__).resolve().parent
+
+# 1x ~ NYT us-counties.csv in May 2020: every census county, first cases spread over
+# March-April, 120 days of reporting from the first NYT date
+g_base_days = 120
+g_first_date = date(2020, 1, 21)
+g_scales = [1, 10, 100]
+
+# ms to import covid19_data_gather.py in a fresh interpreter - measured 37-57ms, numpy is not
+# imported until data is loaded
+g_import_budget_ms = 75
+
+# Stages, as named by covid19_data_gather.py's log_start(); git sync and email are skipped
+g_skipped_stages = ["Update data", "Send email"]
+
+g_bench_conf = {
+    "spreadsheets": {
+        "us": True,
+        "state-detail": ["CA", "ND", "NY"],
+        "custom": {
+            "dakota_battle": ["ND", "SD"],
+            "dakota_battle_capital": ["Burleigh County, ND", "Hughes County, SD"]
+        }
+    },
+    "settings": {
+        "send-email": False,
+        "send-email-client": "Outlook",
+        "case-min-benchmark": 1,
+        "case-days-duration": 28,
+        "geography-per-county": 100000,
+        "geography-per-state": 100000
+    }
+}
+
+###################
+## Synthetic data ############################################################
+
+
+def get_bench_counties(conf, max_counties=None, seed=0):
+    # census counties NYT data can join to, optionally a seeded sample; counties named in
+    # custom spreadsheets are always kept, spreadsheets expect them to have data
+    with contextlib.redirect_stdout(io.StringIO()):
+        (states, counties) = gdg.load_geography()
+    all_counties = [c for c in counties.counties_by_fips.values()
+                    if c.summary_level == 50 and c.get_state() is not None]
+    all_counties.sort(key=lambda c: c.get_fips())
+    if max_counties is not None and max_counties < len(all_counties):
+        rng = np.random.default_rng(seed)
+        keep = set(rng.choice(len(all_counties), max_counties, replace=False).tolist())
+        custom_fips = set()
+        for geographies in conf['spreadsheets']['custom'].values():
+            for geography in geographies:
+                if len(geography) != 2:
+                    custom_fips.add(gdg.get_county_id(states, counties, geography).get_fips())
+        all_counties = [c for (i, c) in enumerate(all_counties) if i in keep or c.get_fips() in custom_fips]
+    return all_counties
+
+
+def gen_us_counties(path, counties, n_days, seed=0):
+    # NYT shaped us-counties.csv: date,county,state,fips,cases,deaths sorted by date, cumulative counts,
+    # plus an "Unknown" (blank fips) row per state.  Returns the number of data rows written.
+    rng = np.random.default_rng(seed)
+
+    prefixes = ["%s,%s,%05d" % (c.get_name(), c.get_state().get_name(), c.get_fips()) for c in counties]
+    population = [max(c.get_population() or 0, 1000) for c in counties]
+    state_names = sorted(set(c.get_state().get_name() for c in counties))
+    prefixes.extend(["Unknown,%s," % (s) for s in state_names])
+    population.extend([10000] * len(state_names))
+
+    n = len(prefixes)
+    population = np.array(population, dtype=np.float64)
+    # first reported day: a few in Jan/Feb, most through March and April
+    start = (g_base_days * 0.3 + rng.gamma(2.0, 10.0, n)).astype(np.int64)
+    early = rng.random(n) < 0.02
+    start[early] = rng.integers(0, g_base_days // 3, np.count_nonzero(early))
+    # daily new cases per 100k; each geography has its own intensity, all share a seasonal wave
+    rate = population / 100000 * rng.lognormal(0.0, 0.75, n)
+    cases = np.zeros(n, dtype=np.int64)
+    deaths = np.zeros(n, dtype=np.int64)
+
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        f.write("date,county,state,fips,cases,deaths\n")
+        for day in range(n_days):
+            live = np.flatnonzero(start <= day)
+            if len(live) == 0:
+                continue
+            wave = 1.25 + np.sin(2 * np.pi * day / 120)
+            new_cases = rng.poisson(rate[live] * wave)
+            cases[live] = np.maximum(cases[live] + new_cases, 1)
+            deaths[live] += rng.binomial(new_cases, 0.015)
+
+            d = (g_first_date + timedelta(days=day)).isoformat()
+            f.writelines(["%s,%s,%d,%d\n" % (d, prefixes[i], c, dd)
+                          for (i, c, dd) in zip(live.tolist(), cases[live].tolist(), deaths[live].tolist())])
+            rows += len(live)
+    return rows
+
+##############
+## Pipeline ##################################################################
+
+
+def get_cpu_time():
+    # this process plus finished children (--jobs xlsx workers)
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+@contextlib.contextmanager
+def bench_stage(stages, name):
+    t_wall = time.perf_counter()
+    t_cpu = get_cpu_time()
+    yield
+    stages[name] = {"wall": round(time.perf_counter() - t_wall, 6),
+                    "cpu": round(get_cpu_time() - t_cpu, 6)}
+
+
+def set_bench_paths(data_path, work_path):
+    # point covid19_data_gather.py at synthetic data and a scratch cache / xlsx directory
+    gdg.g_covid19_data_path = Path(data_path)
+    gdg.g_cache_path = Path(work_path) / "cache"
+    gdg.g_covid19_store_path = gdg.g_cache_path / "us-counties.npz"
+    gdg.g_covid19_metrics_path = gdg.g_cache_path / "metrics"
+    gdg.g_geography_cache_path = gdg.g_cache_path / "geography"
+    gdg.g_xlsx_manifest_path = gdg.g_cache_path / "xlsx-manifest.json"
+    gdg.g_nyt_sync_path = gdg.g_cache_path / "nyt-sync.json"
+    gdg.g_xlsx_path = Path(work_path) / "xlsx"
+    gdg.g_xlsx_path.mkdir(parents=True, exist_ok=True)
+    gdg.g_export_path = Path(work_path) / "export"
+
+
+def run_pipeline(conf_path, jobs=1):
+    # the stages of covid19_data_gather.py's __main__, minus git sync & email; {stage: {wall, cpu}}
+    stages = dict()
+    gdg.g_cmdline_json_path = str(conf_path)
+    gdg.g_jobs = jobs
+
+    with bench_stage(stages, "Load settings"):
+        gdg.load_configuration()
+
+    with bench_stage(stages, "Load geography"):
+        (s, c) = gdg.load_geography()
+        gdg.validate_custom_geographies(s, c)
+
+    with bench_stage(stages, "Process covid data"):
+        gdg.ingest_covid19_data(s, c)
+
+    with bench_stage(stages, "Extract sheet data"):
+        xlsx_jobs = gdg.get_xlsx_jobs(s, c)
+
+    if "xlsx" in gdg.g_export_formats:
+        with bench_stage(stages, "Generate xlsx"):
+            gdg.gen_xlsx_files(xlsx_jobs, jobs)
+
+    if len(set(gdg.g_export_formats) - set(["xlsx"])) > 0:
+        with bench_stage(stages, "Export data"):
+            gdg.gen_export_files(xlsx_jobs)
+
+    stages["Total"] = {"wall": round(sum(v["wall"] for v in stages.values()), 6),
+                       "cpu": round(sum(v["cpu"] for v in stages.values()), 6)}
+    return stages
+
+
+def measure_import(repeat=5):
+    # best of N ms to import covid19_data_gather in a fresh interpreter, and each of its imports
+    cmd = [sys.executable, "-X", "importtime", "-c", "import covid19_data_gather"]
+    subprocess.run(cmd, cwd=g_py_path, capture_output=True)  # bytecode cache, unless PYTHONDONTWRITEBYTECODE
+    best = None
+    for i in range(repeat):
+        p = subprocess.run(cmd, cwd=g_py_path, capture_output=True, text=True, check=True)
+        # import time: self [us] | cumulative | imported package, nested imports indented
+        ms = None
+        imports = dict()
+        for line in p.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            name = fields[2].rstrip()
+            cumulative = int(fields[1]) / 1000
+            if name.strip() == "covid19_data_gather":
+                ms = cumulative
+            elif len(name) - len(name.lstrip()) == 3:
+                imports[name.strip()] = cumulative
+        if best is None or ms < best["ms"]:
+            # importtime lists an import's own imports first; covid19_data_gather's are the top level
+            best = {"ms": round(ms, 3),
+                    "imports": {k: round(v, 3) for (k, v) in imports.items() if v >= 1}}
+    return best
+
+
+##############
+## NYT sync ##################################################################
+
+# --sync-only: update_data() against a local bare repository standing in for the NYT remote -
+# shallow, full and offline syncs, nyt-fetch-interval, and a full clone under "nyt-sync": "shallow".
+# Each check is timed; any failure exits 1.
+
+g_sync_files = {"us-counties.csv": 1000, "us-states.csv": 100000}  # lines; shallow checks out only g_nyt_files
+
+
+def run_bench_git(path, *args):
+    return subprocess.run(["git", "-c", "user.name=covid19_benchmark", "-c", "user.email=covid19_benchmark@localhost"] +
+                          list(args), cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def add_sync_commit(work_path, remote_path, day):
+    # one more NYT day, pushed to the bare remote; returns its commit
+    for (fn, lines) in g_sync_files.items():
+        with open(work_path / fn, 'a') as f:
+            if day == 0:
+                f.write("date,county,state,fips,cases,deaths\n")
+                f.writelines(["2020-01-21,Snohomish,Washington,53061,%d,0\n" % (i) for i in range(lines)])
+            f.write("%s,Snohomish,Washington,53061,%d,0\n" % (g_first_date + timedelta(days=day), day))
+    run_bench_git(work_path, "add", *g_sync_files.keys())
+    run_bench_git(work_path, "commit", "-q", "-m", "day %d" % (day))
+    if day == 0:
+        run_bench_git(None, "clone", "-q", "--bare", str(work_path), str(remote_path))
+        run_bench_git(remote_path, "config", "uploadpack.allowFilter", "true")
+    else:
+        run_bench_git(work_path, "push", "-q", str(remote_path), "HEAD")
+    return run_bench_git(work_path, "rev-parse", "HEAD")
+
+
+def sync_data(data_path, settings):
+    # update_data() into data_path; (HEAD, shallow, checked out files)
+    gdg.g_covid19_data_path = data_path
+    for (name, value) in settings.items():
+        setattr(gdg, name, value)
+    with contextlib.redirect_stdout(io.StringIO()):
+        gdg.update_data()
+    return (gdg.get_git_head(data_path),
+            run_bench_git(data_path, "rev-parse", "--is-shallow-repository") == "true",
+            sorted(fn for fn in os.listdir(data_path) if not fn.startswith(".")))
+
+
+def run_sync_checks():
+    root = Path(tempfile.mkdtemp(prefix="covid19_bench_sync_"))
+    (work_path, remote_path) = (root / "work", root / "covid-19-data.git")
+    (shallow_path, full_path) = (root / "shallow" / "covid-19-data", root / "full" / "covid-19-data")
+    shallow_files = sorted(gdg.g_nyt_files)
+    full_files = sorted(g_sync_files)
+    shallow = {"g_nyt_sync": "shallow", "g_nyt_fetch_interval": 0}
+    full = {"g_nyt_sync": "full", "g_nyt_fetch_interval": 0}
+    checks = []
+
+    def check(name, data_path, settings, expected):
+        t = time.perf_counter()
+        try:
+            got = sync_data(data_path, settings)
+        except (Exception, SystemExit) as e:
+            got = repr(e)
+        wall = time.perf_counter() - t
+        checks.append({"check": name, "ok": got == expected, "wall": round(wall, 6)})
+        print("sync: %-36s %8.3fs %s" % (name, wall, "ok" if got == expected else "FAILED - got %s" % (got,)))
+
+    try:
+        work_path.mkdir()
+        run_bench_git(work_path, "init", "-q")
+        gdg.g_nyt_remote = remote_path.as_uri()
+        gdg.g_nyt_sync_path = root / "cache" / "nyt-sync.json"
+        gdg.g_offline = False
+        gdg.g_git_backend = "cli"
+
+        head = add_sync_commit(work_path, remote_path, 0)
+        check("shallow clone", shallow_path, shallow, (head, True, shallow_files))
+        head = add_sync_commit(work_path, remote_path, 1)
+        check("shallow fetch", shallow_path, shallow, (head, True, shallow_files))
+
+        (prior, head) = (head, add_sync_commit(work_path, remote_path, 2))
+        check("nyt-fetch-interval skips the fetch", shallow_path, dict(shallow, g_nyt_fetch_interval=60),
+              (prior, True, shallow_files))
+        check("offline", shallow_path, dict(shallow, g_nyt_sync="offline"), (prior, True, shallow_files))
+        check("shallow fetch after the interval", shallow_path, shallow, (head, True, shallow_files))
+
+        check("full clone", full_path, full, (head, False, full_files))
+        head = add_sync_commit(work_path, remote_path, 3)
+        check("full pull", full_path, full, (head, False, full_files))
+        # a clone made before nyt-sync is left full
+        head = add_sync_commit(work_path, remote_path, 4)
+        check("shallow setting, full clone", full_path, shallow, (head, False, full_files))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return checks
+
+
+def get_repo_commit():
+    try:
+        return gdg.get_git_head(g_py_path)
+    except Exception:
+        return None
+
+
+def get_import_result(args):
+    result = measure_import()
+    result["budget_ms"] = args.import_budget
+    print("import: %.1fms (budget %.0fms)%s" % (result["ms"], args.import_budget,
+                                               "" if result["ms"] <= args.import_budget else " - OVER BUDGET"))
+    return result
+
+
+def run_benchmark(args):
+    if args.import_only or args.sync_only:
+        # no synthetic data, geography or numpy needed
+        result = {"bench_version": g_bench_version, "commit": get_repo_commit(),
+                  "started": datetime.now().isoformat(timespec='seconds'),
+                  "python": platform.python_version(), "platform": platform.platform()}
+        if args.import_only:
+            result["import"] = get_import_result(args)
+        if args.sync_only:
+            result["sync"] = run_sync_checks()
+        return result
+
+    data_root = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix="covid19_bench_data_"))
+    work_root = Path(tempfile.mkdtemp(prefix="covid19_bench_work_"))
+
+    conf = json.loads(json.dumps(g_bench_conf))
+    if args.conf is not None:
+        with open(args.conf) as f:
+            conf = json.load(f)
+    conf["settings"]["send-email"] = False
+    if args.us_counties:
+        conf["spreadsheets"]["us-counties"] = True
+    if args.export is not None:
+        conf["settings"]["export-formats"] = args.export.split(",")
+    conf["settings"]["ingest-engine"] = args.engine
+    conf["settings"]["xlsx-reuse"] = False  # always time xlsx generation, even --warm
+    conf_path = work_root / "bench_conf.json"
+    with open(conf_path, 'w') as f:
+        json.dump(conf, f, indent=4)
+
+    set_bench_paths(data_root, work_root / "geography")
+    counties = get_bench_counties(conf, args.counties, args.seed)
+
+    result = {
+        "bench_version": g_bench_version,
+        "commit": get_repo_commit(),
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {"engine": args.engine, "jobs": args.jobs, "days": args.days, "counties": len(counties),
+                     "seed": args.seed, "repeat": args.repeat, "warm": args.warm,
+                     "us-counties": args.us_counties, "export": args.export},
+        "skipped_stages": g_skipped_stages,
+        "scales": []
+    }
+
+    result["import"] = get_import_result(args)
+
+    try:
+        for scale in args.scales:
+            n_days = args.days * scale
+            data_path = data_root / ("x%d" % (scale))
+            data_path.mkdir(parents=True, exist_ok=True)
+            csv_path = data_path / "us-counties.csv"
+
+            print("%4dx: generating %d days x %d counties ..." % (scale, n_days, len(counties)), end='', flush=True)
+            t = time.perf_counter()
+            rows = gen_us_counties(csv_path, counties, n_days, args.seed)
+            print(" %d rows [%.1fs]" % (rows, time.perf_counter() - t))
+
+            scale_result = {"scale": scale, "days": n_days, "rows": rows,
+                            "csv_bytes": csv_path.stat().st_size, "runs": []}
+
+            for run in range(args.repeat):
+                # cold by default: nothing cached from a prior run (geography, ingest store)
+                work_path = work_root / ("x%d_%d" % (scale, run))
+                set_bench_paths(data_path, work_path)
+                if args.warm:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        run_pipeline(conf_path, args.jobs)
+
+                # don't bill this run for collecting the last one
+                gc.collect()
+                out = sys.stdout if args.verbose else io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    stages = run_pipeline(conf_path, args.jobs)
+                scale_result["runs"].append(stages)
+
+                print("%4dx: run %d" % (scale, run + 1))
+                for (stage, t) in stages.items():
+                    print("       %-34s %10.3fs wall %10.3fs cpu" % (stage, t["wall"], t["cpu"]))
+
+                if not args.keep:
+                    shutil.rmtree(work_path, ignore_errors=True)
+
+            # best of N per stage, the number to compare between commits
+            scale_result["best"] = {stage: min(r[stage]["wall"] for r in scale_result["runs"])
+                                    for stage in scale_result["runs"][0]}
+            result["scales"].append(scale_result)
+
+            if not args.data_dir and not args.keep:
+                shutil.rmtree(data_path, ignore_errors=True)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_root, ignore_errors=True)
+            if not args.data_dir:
+                shutil.rmtree(data_root, ignore_errors=True)
+        else:
+            print("Kept %s, %s" % (data_root, work_root))
+
+    return result
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(
+        description="Benchmark covid19_data_gather.py stages against synthetic NYT us-counties.csv data.")
+    parser.add_argument("--scales", default=",".join(str(s) for s in g_scales),
+                        help="comma separated multiples of the 1x row count (default: %(default)s)")
+    parser.add_argument("--days", type=int, default=g_base_days,
+                        help="days of reporting at 1x; scales multiply days (default: %(default)s)")
+    parser.add_argument("--counties", type=int, default=None,
+                        help="sample N census counties (default: all)")
+    parser.add_argument("--engine", choices=["columnar", "object"], default="columnar",
+                        help="ingest engine (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="xlsx generation processes (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="timed runs per scale; best of N is reported (default: %(default)s)")
+    parser.add_argument("--warm", action="store_true",
+                        help="prime geography / ingest caches with an untimed run first")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="synthetic data seed (default: %(default)s)")
+    parser.add_argument("--conf", default=None,
+                        help="spreadsheet configuration (default: built in US, CA/ND/NY and custom sheets)")
+    parser.add_argument("--us-counties", action="store_true",
+                        help="add the all counties spreadsheet to the configuration")
+    parser.add_argument("--export", default=None,
+                        help="comma separated export-formats, eg xlsx,csv (default: the configuration's)")
+    parser.add_argument("--data-dir", default=None,
+                        help="write synthetic us-counties.csv files here and keep them")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep synthetic data, caches and xlsx files")
+    parser.add_argument("-o", "--output", default=None,
+                        help="write JSON results to this file (default: stdout)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="show covid19_data_gather.py output")
+    parser.add_argument("--import-budget", type=float, default=g_import_budget_ms,
+                        help="covid19_data_gather.py import time budget, ms (default: %(default)s)")
+    parser.add_argument("--import-only", action="store_true",
+                        help="only measure import time; exit 1 if over budget")
+    parser.add_argument("--sync-only", action="store_true",
+                        help="only check NYT git sync against a local bare repository; exit 1 on failure")
+    args = parser.parse_args()
+    args.scales = [int(s) for s in args.scales.split(",")]
+    args.jobs = max(args.jobs, 1)
+    args.repeat = max(args.repeat, 1)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_command_line()
+    result = run_benchmark(args)
+    s = json.dumps(result, indent=1, sort_keys=True)
+    if args.output is None:
+        print(s)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(s)
+            f.write("\n")
+        print("Wrote %s" % (args.output))
+    if args.import_only and result["import"]["ms"] > args.import_budget:
+        print("covid19_data_gather.py import %.1fms is over the %.0fms budget" % (result["import"]["ms"], args.import_budget),
+              file=sys.stderr)
+        sys.exit(1)
+    if args.sync_only and not all(c["ok"] for c in result["sync"]):
+        print("NYT sync failed: %s" % (", ".join(c["check"] for c in result["sync"] if not c["ok"])), file=sys.stderr)
+        sys.exit(1)
@@ -1,5 +1,11 @@
 ############
 ## IMPORTS ####################################################################
+# Heavy or optional packages - numpy, openpyxl, gitpython, fastjsonschema, pywin32 - and modules used
+# by a single mode or code path - argparse, subprocess (git CLI), cProfile / tracemalloc (--cprofile,
+# --trace), io / threading (--serve) - are imported where they are used, so startup pays only for
+# what the run needs.
+# covid19_benchmark.py measures import time against g_import_budget_ms.
+
 # data i/o
 from pathlib import Path
 import sys
@@ -7,6 +13,12 @@ import csv
 import copy
 import os.path
 import shutil
+import hashlib
+import importlib.util
+
+# --trace / --cprofile stage names & timing
+import re
+import time
 
 # date math
 import datetime
@@ -14,27 +26,13 @@ from datetime import date, datetime, timedelta
 
 # json
 import json
-import fastjsonschema
-
-# NYT git clone
-from git import Repo
-
-# xlsx handling
-import openpyxl
-from openpyxl import Workbook
-from openpyxl.chart import (
-    LineChart,
-    Reference,
-    Series,
-)
-
-# Email send c/o outlook
-import win32com.client
-from win32com.client import Dispatch, constants
 
 # Enumerations
 from enum import Enum
 
+# columnar covid19 ingest
+from array import array
+
 #########
 ## todo #######################################################################
 #########
@@ -48,17 +46,31 @@ g_json_path_orig = g_json_path
 g_json_path_default = g_py_path / "sample_covid19_data_gather_conf.json"
 g_json_schema_path = g_py_path / "covid19_data_gather_conf.schema.json"
 g_xlsx_path = g_py_path / "xlsx"
+g_export_path = g_py_path / "export"
 g_root_path = g_py_path.parent
 g_covid19_data_path = g_root_path / "covid-19-data"
+g_cache_path = g_py_path / "cache"
+g_covid19_store_path = g_cache_path / "us-counties.npz"
+g_covid19_metrics_path = g_cache_path / "metrics"
+g_json_validator_path = g_cache_path / "schema"
 
 # Global App Settings
 # g_debug = True
 g_debug = False
-g_date_fmt = '%Y-%m-%d'  # As per NYT data (YYYY-MM-DD)
 
 # Set to false to disable json validation should it prove troublesome in the future.
 g_json_validate = True
 
+# Command line, see parse_command_line()
+g_cmdline_json_path = None
+g_cmdline_batch_paths = []  # several configuration files / directories of them - batch mode
+g_jobs = 1  # --jobs; number of processes generating xlsx files
+g_offline = False  # --offline; same as "nyt-sync": "offline"
+g_trace_path = None  # --trace; per stage wall / cpu / peak memory JSON, see ProfileStage
+g_cprofile_path = None  # --cprofile; directory receiving a cProfile dump per stage
+g_serve_address = None  # --serve; (host, port) of the resident HTTP service, see Covid19Service
+g_serve_refresh = 10  # --refresh; minutes between NYT data checks in --serve mode
+
 
 ## JSON Based Conf ###############################################################
 # App settings should be stored in covid19_data_gather_conf.json in a "settings": { ... } block.
@@ -72,16 +84,31 @@ g_json_validate = True
 #   2. To assign_global_vars(), add:
 #      * global g_<abbr key name>
 #      * g_<abbr key name> = get_global_conf(SETTING, '<full key name>', g_<abbr key name>)
-#   3. Use g_<abbr key name> as normal in rest of program.
+#   3. Add 'g_<abbr key name>' to g_settings_vars
+#   4. Use g_<abbr key name> as normal in rest of program.
 
 g_conf = dict()
+g_confs = []  # [(path, conf)] of this run - several in batch mode, see load_batch_configuration()
 
 # Default Settings
 # Minimum case count to be charted; set to 1 for accurate active counts
 g_case_benchmark = 1
 g_days = 28  # 4 weeks * 7 days per week
+g_days_sweep = []  # columnar only - additional case durations, each adds an "active N days" worksheet
+g_rolling_windows = [7, 14]  # days; each adds moving average, growth & doubling worksheets, see get_rolling_metrics()
 g_per_county = 100000
 g_per_state = 100000
+g_ingest_engine = "columnar"  # columnar | object
+g_ingest_store = True  # columnar only - persist ingested data, parse only new/revised rows
+g_ingest_pushdown = True  # ingest only the NYT data configured spreadsheets need, see IngestFilter
+g_xlsx_write_only = False  # stream rows to xlsx via openpyxl write-only worksheets
+g_xlsx_chart_series = 100  # most location series per chart, see XLSX.get_chart_cols()
+g_export_formats = ["xlsx"]  # xlsx and/or g_export_writers - csv, parquet, arrow
+g_xlsx_reuse = True  # skip rebuilding xlsx files whose inputs are unchanged, see get_xlsx_fingerprint()
+g_nyt_remote = "https://github.com/nytimes/covid-19-data"
+g_nyt_sync = "shallow"  # shallow | full | offline, see update_data()
+g_nyt_fetch_interval = 0  # minutes; skip the NYT fetch if the last one is more recent
+g_git_backend = "cli"  # cli | gitpython, see run_git()
 
 g_email = False
 g_email_client = "N/A"
@@ -90,6 +117,19 @@ g_email_style = "font-family: Trebuchet MS; color:#25253b; font-size:14pt"
 g_email_greeting = "Hello!<br>"
 g_email_sig = "xoxo<br>Yours Truly"
 
+# Globals assigned from "settings"; batch mode resets them to the defaults above between configurations
+g_settings_vars = ['g_case_benchmark', 'g_days', 'g_days_sweep', 'g_rolling_windows', 'g_per_county', 'g_per_state',
+                   'g_ingest_engine', 'g_ingest_store', 'g_ingest_pushdown', 'g_xlsx_write_only',
+                   'g_xlsx_chart_series', 'g_export_formats', 'g_xlsx_reuse', 'g_nyt_remote', 'g_nyt_sync',
+                   'g_nyt_fetch_interval', 'g_git_backend', 'g_email', 'g_email_client', 'g_email_to',
+                   'g_email_style', 'g_email_greeting', 'g_email_sig']
+
+# Settings of a batch's single data load - the first configuration's, see load_batch_configuration()
+g_batch_data_vars = ['g_ingest_engine', 'g_ingest_store', 'g_ingest_pushdown', 'g_nyt_remote', 'g_nyt_sync',
+                     'g_nyt_fetch_interval', 'g_git_backend']
+g_batch_defaults = None  # {global: default} of g_settings_vars, g_xlsx_path & g_export_path
+g_batch_data = None  # {global: value} of g_batch_data_vars
+
 
 # Metadata
 g_state_abbr = ["AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS",
@@ -115,10 +155,10 @@ def dbg(s):
 #
 
 
-def abort():
-    print()
-    print("Aborting.")
-    print()
+def abort(file=None):
+    print(file=file)
+    print("Aborting.", file=file)
+    print(file=file)
     exit(1)
 
 
@@ -137,6 +177,112 @@ def log_end(t_start):
     delta = t_end-t_start
     print(' ['+str(delta)+']')
 
+##############
+## Profiling ##################################################################
+#
+# with ProfileStage("Load geography"):
+#     ...
+#
+# No-op unless --trace / --cprofile.  Each stage records wall & cpu seconds and, with --trace,
+# tracemalloc's peak; with --cprofile, a <stage>.prof dump (python -m pstats <stage>.prof).
+#
+# Stages nest - each XLSX build & save runs within "Generate xlsx".  A nested stage's calls
+# are only in its own .prof; its memory peak counts toward the enclosing stage's peak too.
+
+g_trace = []  # completed stages, in completion order
+g_trace_stack = []  # active ProfileStage(s)
+g_trace_t0 = time.perf_counter()
+g_trace_started = datetime.now()
+
+
+class ProfileStage:
+    def __init__(self, name):
+        self.name = name
+        self.enabled = g_trace_path is not None or g_cprofile_path is not None
+        self.profiler = None
+        self.mem_peak = 0
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+
+        import cProfile
+        import tracemalloc
+        self.parent = g_trace_stack[-1] if len(g_trace_stack) > 0 else None
+        g_trace_stack.append(self)
+
+        if tracemalloc.is_tracing():
+            (mem_cur, mem_peak) = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.mem_peak = max(self.parent.mem_peak, mem_peak)
+            tracemalloc.reset_peak()
+            self.mem_start = mem_cur
+            self.mem_peak = mem_cur
+
+        if g_cprofile_path is not None:
+            if self.parent is not None and self.parent.profiler is not None:
+                self.parent.profiler.disable()
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.t_wall = time.perf_counter()
+        self.t_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.enabled:
+            return False
+
+        import tracemalloc
+        t_wall = time.perf_counter()
+        stage = {'stage': self.name,
+                 'parent': self.parent.name if self.parent is not None else None,
+                 'pid': os.getpid(),
+                 'start': round(self.t_wall - g_trace_t0, 6),
+                 'wall': round(t_wall - self.t_wall, 6),
+                 'cpu': round(time.process_time() - self.t_cpu, 6)}
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            g_cprofile_path.mkdir(parents=True, exist_ok=True)
+            prof_fn = g_cprofile_path / \
+                ("%s.prof" % (re.sub(r'[^A-Za-z0-9]+', '_', self.name).strip('_').lower()))
+            self.profiler.dump_stats(prof_fn)
+            stage['profile'] = str(prof_fn)
+            if self.parent is not None and self.parent.profiler is not None:
+                self.parent.profiler.enable()
+
+        if tracemalloc.is_tracing():
+            (mem_cur, mem_peak) = tracemalloc.get_traced_memory()
+            self.mem_peak = max(self.mem_peak, mem_peak)
+            stage['mem_start'] = self.mem_start
+            stage['mem_end'] = mem_cur
+            stage['mem_peak'] = self.mem_peak
+            if self.parent is not None:
+                self.parent.mem_peak = max(self.parent.mem_peak, self.mem_peak)
+
+        if exc_type is not None:
+            stage['error'] = repr(exc_value)
+
+        g_trace_stack.pop()
+        g_trace.append(stage)
+        return False
+
+
+def write_trace():
+    if g_trace_path is None:
+        return
+
+    trace = {'started': g_trace_started.isoformat(timespec='seconds'),
+             'argv': sys.argv,
+             'jobs': g_jobs,
+             'ingest-engine': g_ingest_engine,
+             'xlsx-write-only': g_xlsx_write_only,
+             'stages': sorted(g_trace, key=lambda stage: stage['start'])}
+    with open(g_trace_path, 'w') as f:
+        json.dump(trace, f, indent=1)
+        f.write("\n")
+
 ###############
 # json config #################################################################
 
@@ -145,31 +291,61 @@ def log_end(t_start):
 #
 
 
-def validate_json():
+def get_json_validator():
+    # fastjsonschema compiles the schema to python; that code is kept in g_json_validator_path,
+    # named by the schema's sha1, so later runs import it rather than compile it.
+    with open(g_json_schema_path, 'rb') as f:
+        schema = f.read()
+    path = g_json_validator_path / ("conf_validator_%s.py" % (hashlib.sha1(schema).hexdigest()))
+
+    if path.exists():
+        try:
+            spec = importlib.util.spec_from_file_location(path.stem, path)
+            validator = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(validator)
+            return validator.validate
+        except Exception as e:
+            dbg("schema validator - unable to load %s: %s" % (path, e))
+
+    import fastjsonschema
+    definition = json.loads(schema)
+    code = fastjsonschema.compile_to_code(definition)
+    code += "\nvalidate = %s\n" % (fastjsonschema.RefResolver.from_schema(definition).get_scope_name())
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(code)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        dbg("schema validator - unable to save %s: %s" % (path, e))
+
+    validator = dict()
+    exec(code, validator)
+    return validator['validate']
+
+
+def validate_json(file=None):
+    # errors are printed to file, default sys.stdout
     if not g_json_validate:
         return
 
     global g_conf
 
-    # load json conf schema into memory
-    s = ""
-    with open(g_json_schema_path) as f:
-        s = json.load(f)
-    f.close()
-
     # validate json conf vs schema
-    v = fastjsonschema.compile(s)
+    v = get_json_validator()
+    import fastjsonschema  # already loaded by the validator
     try:
         v(g_conf)
     except fastjsonschema.JsonSchemaException as e:
-        print()
-        print()
-        print(f"Error - Invalid {g_json_path}")
-        print(f"        -> \"{e.name}\": \"{e.value}\" <-")
-        print(f"        {e.message}")
-        print()
-        print(f"Please update {g_json_path} and try again!")
-        abort()
+        print(file=file)
+        print(file=file)
+        print(f"Error - Invalid {g_json_path}", file=file)
+        print(f"        -> \"{e.name}\": \"{e.value}\" <-", file=file)
+        print(f"        {e.message}", file=file)
+        print(file=file)
+        print(f"Please update {g_json_path} and try again!", file=file)
+        abort(file)
 
 
 def get_global_conf(conf_block, setting, default):
@@ -190,8 +366,21 @@ def assign_global_vars():
     global g_email_sig
     global g_case_benchmark
     global g_days
+    global g_days_sweep
+    global g_rolling_windows
     global g_per_county
     global g_per_state
+    global g_ingest_engine
+    global g_ingest_store
+    global g_ingest_pushdown
+    global g_xlsx_write_only
+    global g_xlsx_chart_series
+    global g_export_formats
+    global g_xlsx_reuse
+    global g_nyt_remote
+    global g_nyt_sync
+    global g_nyt_fetch_interval
+    global g_git_backend
 
     SETTING = 'settings'
 
@@ -204,27 +393,106 @@ def assign_global_vars():
     g_email_sig = get_global_conf(SETTING, 'send-email-signature', g_email_sig)
     g_case_benchmark = get_global_conf(
         SETTING, 'case-min-benchmark', g_case_benchmark)
-    g_days = get_global_conf(SETTING, 'case-days-duration', g_days)
+    # whole days - the schema allows eg 14.5, which date + timedelta(days=14.5) always truncated
+    g_days = int(get_global_conf(SETTING, 'case-days-duration', g_days))
+    g_days_sweep = [int(d) for d in get_global_conf(
+        SETTING, 'case-days-duration-sweep', g_days_sweep)]
+    g_rolling_windows = get_global_conf(
+        SETTING, 'case-rolling-windows', g_rolling_windows)
     g_per_county = get_global_conf(
         SETTING, 'geography-per-county', g_per_county)
     g_per_state = get_global_conf(SETTING, 'geography-per-state', g_per_state)
+    g_ingest_engine = get_global_conf(
+        SETTING, 'ingest-engine', g_ingest_engine)
+    g_ingest_store = get_global_conf(SETTING, 'ingest-store', g_ingest_store)
+    g_ingest_pushdown = get_global_conf(
+        SETTING, 'ingest-pushdown', g_ingest_pushdown)
+    g_xlsx_write_only = get_global_conf(
+        SETTING, 'xlsx-write-only', g_xlsx_write_only)
+    g_xlsx_chart_series = get_global_conf(
+        SETTING, 'xlsx-chart-series', g_xlsx_chart_series)
+    g_export_formats = get_global_conf(
+        SETTING, 'export-formats', g_export_formats)
+    g_xlsx_reuse = get_global_conf(SETTING, 'xlsx-reuse', g_xlsx_reuse)
+    g_nyt_remote = get_global_conf(SETTING, 'nyt-remote', g_nyt_remote)
+    g_nyt_sync = get_global_conf(SETTING, 'nyt-sync', g_nyt_sync)
+    g_nyt_fetch_interval = get_global_conf(
+        SETTING, 'nyt-fetch-interval', g_nyt_fetch_interval)
+    g_git_backend = get_global_conf(SETTING, 'git-backend', g_git_backend)
+
+
+def parse_command_line():
+    global g_cmdline_json_path
+    global g_cmdline_batch_paths
+    global g_jobs
+    global g_offline
+    global g_trace_path
+    global g_cprofile_path
+    global g_serve_address
+    global g_serve_refresh
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Send Outlook email w/covid-19 XLSX attachments, using New York Times as data source.")
+    parser.add_argument("json_path", nargs="*", default=[],
+                        help=f"configuration file(s), or directories of them (default: {g_json_path})")
+    parser.add_argument("-j", "--jobs", type=int, default=g_jobs,
+                        help="generate xlsx files in N processes (default: %(default)s)")
+    parser.add_argument("--offline", action="store_true",
+                        help="use the local copy of NYT data, no git fetch")
+    parser.add_argument("--trace", metavar="TRACE.json", default=None,
+                        help="write wall / cpu time and peak memory of each stage to TRACE.json")
+    parser.add_argument("--cprofile", metavar="DIR", default=None,
+                        help="write a cProfile dump of each stage into DIR")
+    parser.add_argument("--serve", metavar="[HOST:]PORT", default=None,
+                        help="load NYT data once, then generate xlsx files for configurations POSTed to HOST:PORT")
+    parser.add_argument("--refresh", metavar="MINUTES", type=float, default=g_serve_refresh,
+                        help="--serve: check for new NYT data every MINUTES (default: %(default)s)")
+    args = parser.parse_args()
+
+    if len(args.json_path) == 1 and not os.path.isdir(args.json_path[0]):
+        g_cmdline_json_path = args.json_path[0]
+    elif len(args.json_path) > 0:
+        g_cmdline_batch_paths = args.json_path
+    g_jobs = max(args.jobs, 1)
+    g_offline = args.offline
+
+    if args.trace is not None:
+        import tracemalloc
+        g_trace_path = Path(args.trace)
+        tracemalloc.start()
+    if args.cprofile is not None:
+        g_cprofile_path = Path(args.cprofile)
+    if args.serve is not None:
+        (host, _, port) = args.serve.rpartition(':')
+        if not port.isdigit():
+            parser.error("--serve: expected [HOST:]PORT, got %s" % (args.serve))
+        g_serve_address = (host or "127.0.0.1", int(port))
+        if len(g_cmdline_batch_paths) > 0:
+            parser.error("--serve: expected a single configuration file")
+    g_serve_refresh = args.refresh
 
 
 def load_configuration():
     global g_conf
+    global g_confs
     global g_json_path
 
+    if len(g_cmdline_batch_paths) > 0:
+        load_batch_configuration()
+        return
+
     cmdline_override = False
 
-    if len(sys.argv) > 1:
-        potential_json_fn = sys.argv[1]
+    if g_cmdline_json_path is not None:
+        potential_json_fn = g_cmdline_json_path
         if not os.path.exists(potential_json_fn):
             print()
             print(f"{potential_json_fn} does not exist.")
             print(f"Falling back to {g_json_path}")
             print()
         else:
-            g_json_path = sys.argv[1]
+            g_json_path = g_cmdline_json_path
             cmdline_override = True
             print()
             print(f"Using config override: {g_json_path}")
@@ -258,92 +526,297 @@ def load_configuration():
     validate_json()
 
     assign_global_vars()
+    g_confs = [(g_json_path, g_conf)]
+
+    log_end(t)
+
+
+# Batch mode - several configuration files, or directories of them, on the command line:
+#
+#   python ./covid19_data_gather.py team_a.json team_b.json confs/
+#
+# Every configuration is loaded & validated before any data is.  NYT data is synced & ingested
+# once, for all of them; then each configuration's spreadsheets, exports & email are generated
+# in turn, against that shared model.
+#
+# Settings a configuration omits take their defaults, not the previous configuration's.  Data
+# settings (g_batch_data_vars - git sync & ingest) come from the first configuration; ingest
+# pushdown applies only when every configuration enables it.  Each configuration writes to its
+# own xlsx/<name>/ and export/<name>/ directory, <name> being its file name without ".json".
+
+
+def get_batch_conf_paths():
+    # configuration files of g_cmdline_batch_paths, directories expanded to their *.json files
+    conf_paths = []
+    for path in map(Path, g_cmdline_batch_paths):
+        if path.is_dir():
+            conf_paths.extend(sorted(p for p in path.glob("*.json")
+                                     if p.is_file() and not p.name.endswith(".schema.json")))
+        elif path.exists():
+            conf_paths.append(path)
+        else:
+            print()
+            print(f"{path} does not exist.")
+            abort()
+    return conf_paths
+
+
+def set_configuration(conf_path, conf):
+    # make conf the current configuration; batch mode re-assigns settings from their defaults
+    global g_conf
+    global g_json_path
+    global g_xlsx_path
+    global g_export_path
+
+    g_json_path = conf_path
+    g_conf = conf
+    if g_batch_defaults is None:
+        return
+
+    globals().update(g_batch_defaults)
+    assign_global_vars()
+    if g_batch_data is not None:
+        globals().update(g_batch_data)
+    g_xlsx_path = g_batch_defaults['g_xlsx_path'] / Path(conf_path).stem
+    g_export_path = g_batch_defaults['g_export_path'] / Path(conf_path).stem
+    g_xlsx_path.mkdir(parents=True, exist_ok=True)
+
+
+def load_batch_configuration():
+    global g_confs
+    global g_batch_defaults
+    global g_batch_data
+
+    conf_paths = get_batch_conf_paths()
+    if len(conf_paths) == 0:
+        print()
+        print(f"No configuration files found in {', '.join(g_cmdline_batch_paths)}")
+        abort()
+    names = [conf_path.stem for conf_path in conf_paths]
+    if len(set(names)) != len(names):
+        print()
+        print("Configuration file names must be unique, each names its xlsx / export directory:")
+        print(f"        {', '.join(map(str, conf_paths))}")
+        abort()
+
+    t = log_start(f"Load settings - batch of {len(conf_paths)}")
+
+    g_batch_defaults = {var: globals()[var] for var in g_settings_vars + ['g_xlsx_path', 'g_export_path']}
+    g_confs = []
+    batch_data = []
+    pushdown = True
+    days = set()
+    for conf_path in conf_paths:
+        with open(conf_path) as f:
+            conf = json.load(f)
+        set_configuration(conf_path, conf)
+        validate_json()
+        g_confs.append((conf_path, conf))
+        batch_data.append({var: globals()[var] for var in g_batch_data_vars})
+        pushdown = pushdown and g_ingest_pushdown
+        days.add(g_days)
+
+    g_batch_data = dict(batch_data[0], g_ingest_pushdown=pushdown)
+    set_configuration(*g_confs[0])
+
+    # object ingest computes active cases once, for every configuration
+    if g_ingest_engine == "object" and len(days) > 1:
+        print()
+        print("Error - a batch with \"ingest-engine\": \"object\" requires the same case-days-duration in each configuration")
+        abort()
 
     log_end(t)
 
+    for (var, value) in g_batch_data.items():
+        ignored = [str(conf_path) for ((conf_path, conf), data) in zip(g_confs, batch_data)
+                   if var != 'g_ingest_pushdown' and data[var] != value]
+        if len(ignored) > 0:
+            print(f"Note - {var[2:].replace('_', '-')} of {', '.join(ignored)} ignored, using {conf_paths[0]}'s")
+
 
 #######
 # git #########################################################################
 
 # git pull remote for nyt data
+#
+# nyt-sync:
+#   shallow - clone / fetch only the newest commit, checking out only g_nyt_files (default).
+#             A full clone - eg from before nyt-sync - is left as it is and pulled; delete it
+#             to re-clone shallow.
+#   full    - clone / pull the whole repo & its history
+#   offline - no network, use the local copy as-is (also --offline)
+#
+# nyt-fetch-interval skips the fetch when the last successful one, kept in g_nyt_sync_path,
+# is more recent.  A failed fetch falls back to the local copy.
+#
+# nyt-remote can be any git url - eg file:///path/to/covid-19-data.git for testing.
+#
+# git-backend picks how git commands are run: "cli" - the git command line (default), or
+# "gitpython" - GitPython, imported only then.  Either way, a failed command raises GitError.
 
+g_nyt_files = ["us-counties.csv"]  # the NYT csv files ingested; shallow checks out only these
+g_nyt_sync_path = g_cache_path / "nyt-sync.json"
 
-def update_data():
-    br()
 
-    if not os.path.exists(g_covid19_data_path):
-        t_clone = log_start("First run - cloning nyt source data!")
-        cr = Repo.clone_from(
-            "https://github.com/nytimes/covid-19-data", g_covid19_data_path)
-        log_start("Complete!")
-        log_end(t_clone)
+class GitError(Exception):
+    pass
 
 
-    t = log_start("Checking nyt source data... ")
-    r = Repo(g_covid19_data_path)
-    cur_head = r.head.commit
-    fetches = r.remotes.origin.pull()
+def run_git_cli(path, *args):
+    import subprocess
+    try:
+        p = subprocess.run(["git"] + list(args), cwd=path, capture_output=True, text=True)
+    except OSError as e:
+        raise GitError("git %s: %s" % (args[0], e))
+    if p.returncode != 0:
+        raise GitError("git %s: %s" % (" ".join(args), p.stderr.strip()))
+    return p.stdout.rstrip("\n")
 
-    if cur_head == r.head.commit:
-        print("No updates.")
-    else:
-        for f in fetches:
-            print("Updated %s to %s - %s" % (f.ref, f.commit, f.note))
 
-    log_start("Complete!")
-    log_end(t)
+def run_git_python(path, *args):
+    try:
+        from git import Git
+        from git.exc import GitCommandError
+    except ImportError:
+        dbg("gitpython is not installed, using the git command line")
+        return run_git_cli(path, *args)
+    try:
+        return Git(path).execute(["git"] + list(args))
+    except GitCommandError as e:
+        raise GitError(str(e))
 
-#
-# Todo - update getters/setters to properties
 
-##################
-### Date Caching ##############################################################
+g_git_backends = {"cli": run_git_cli, "gitpython": run_git_python}
 
-# Active = YTD (Today) - YTD (28 days ago)
-# To simplify the math we map 'today' to '28 days in the future'.  Ok, this is probably complicating it but???
-# Since we are processing thousands of cases, which potentially could be on the same day,
-# we don't want to perform this expensive date calculation with each record.
-# Instead, we cache Today => 28 days into the future in a global dictionary for use by the county class.
-# states are the aggregation of counties, and don't need to do this calculation at the state level.
 
+def run_git(path, *args):
+    # stdout of git <args> run in path
+    return g_git_backends[g_git_backend](path, *args)
 
-g_active_date_map = dict()
 
+def get_git_head(path):
+    return run_git(path, "rev-parse", "HEAD")
 
-def cache_active_to_inactive_date_map():
-    br()
-    t = log_start('Caching active to inactive dates')
 
-    global g_active_date_map
-    g_active_date_map = dict()
+def get_last_fetch():
+    # datetime of the last successful fetch from g_nyt_remote, or None
+    try:
+        with open(g_nyt_sync_path) as f:
+            nyt_sync = json.load(f)
+        if nyt_sync['remote'] != g_nyt_remote:
+            return None
+        return datetime.fromisoformat(nyt_sync['fetched'])
+    except Exception:
+        return None
 
-    # From Jan-2020 to Today
-    date_active = date(2020, 1, 1)
-    # Assume consant illness window of g_days
-    date_inactive = date_active+timedelta(days=g_days)
-    date_now = date.today()
 
-    # Increment a day at a time
-    date_delta = timedelta(days=1)
+def set_last_fetch():
+    g_nyt_sync_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(g_nyt_sync_path, 'w') as f:
+        json.dump({'remote': g_nyt_remote, 'fetched': datetime.now().isoformat(timespec='seconds'),
+                   'commit': get_git_head(g_covid19_data_path)}, f)
 
-    date_active_str = ""
-    date_inactive_str = ""
 
-    while date_active <= date_now:
-        # str conversion
-        date_active_str = date_active.strftime(g_date_fmt)
-        date_inactive_str = date_inactive.strftime(g_date_fmt)
+def clone_data():
+    t_clone = log_start("First run - cloning nyt source data!")
+    try:
+        if g_nyt_sync == "shallow":
+            run_git(None, "clone", "--depth=1", "--filter=blob:none", "--sparse", "--no-checkout",
+                    g_nyt_remote, str(g_covid19_data_path))
+            run_git(g_covid19_data_path, "sparse-checkout", "set", "--no-cone", *g_nyt_files)
+            run_git(g_covid19_data_path, "checkout")
+        else:
+            run_git(None, "clone", g_nyt_remote, str(g_covid19_data_path))
+    except GitError as e:
+        print()
+        print(f"Unable to clone {g_nyt_remote}.")
+        print(e)
+        shutil.rmtree(g_covid19_data_path, ignore_errors=True)
+        abort()
+    set_last_fetch()
+    log_start("Complete!")
+    log_end(t_clone)
+
+
+def fetch_data():
+    path = g_covid19_data_path
+    if run_git(path, "config", "--get", "remote.origin.url") != g_nyt_remote:
+        run_git(path, "remote", "set-url", "origin", g_nyt_remote)
+
+    cur_head = get_git_head(path)
+    shallow = g_nyt_sync == "shallow" and run_git(path, "rev-parse", "--is-shallow-repository") == "true"
+    if g_nyt_sync == "shallow" and not shallow:
+        dbg("nyt-sync shallow - %s is a full clone, pulling" % (path))
+    if shallow:
+        # newest commit only; the data repo is never edited, so reset rather than merge
+        run_git(path, "fetch", "--depth=1", "origin", run_git(path, "symbolic-ref", "--short", "HEAD"))
+        run_git(path, "reset", "--hard", "FETCH_HEAD")
+    else:
+        run_git(path, "pull")
 
-        # map
-        # print(date_active_str+" => "+date_inactive_str)
-        g_active_date_map[date_active_str] = date_inactive_str
+    head = get_git_head(path)
+    if cur_head == head:
+        print("No updates.")
+    else:
+        print("Updated to %s - %s" % (head, run_git(path, "log", "-1", "--format=%s")))
 
-        # increment
-        date_active += date_delta
-        date_inactive += date_delta
 
+def update_data():
+    br()
+    offline = g_offline or g_nyt_sync == "offline"
+
+    if not os.path.exists(g_covid19_data_path):
+        if offline:
+            print(f"Offline, and there is no local copy of nyt source data at {g_covid19_data_path}.")
+            abort()
+        clone_data()
+        return
+
+    t = log_start("Checking nyt source data... ")
+    last_fetch = get_last_fetch()
+
+    if offline:
+        print("Offline - using local copy (%s)." % (get_git_head(g_covid19_data_path)))
+    elif last_fetch is not None and datetime.now() - last_fetch < timedelta(minutes=g_nyt_fetch_interval):
+        print("Last fetched %s, within %i minutes - skipped." %
+              (last_fetch.strftime("%Y-%m-%d %H:%M"), g_nyt_fetch_interval))
+    else:
+        try:
+            fetch_data()
+            set_last_fetch()
+        except GitError as e:
+            print("Unable to fetch %s, using local copy (%s)." % (g_nyt_remote, get_git_head(g_covid19_data_path)))
+            dbg(e)
+
+    log_start("Complete!")
     log_end(t)
 
+#
+# Todo - update getters/setters to properties
+
+#########
+### Dates ######################################################################
+
+# Dates are held as integer days since g_day_epoch - Covid19Stat.case_day, the columns of a
+# Covid19Matrix, the keys of County / State covid19 cases.  NYT 'YYYY-MM-DD' text is parsed once
+# per distinct date at ingest; days are turned back into text only for xlsx / export cells.
+#
+# Active = YTD (Today) - YTD (g_days ago): the case count of day d stops being active on day
+# d + g_days, and a week ago is day d - 7.
+
+g_day_epoch = date(2020, 1, 1)  # day 0
+g_day_epoch_ordinal = g_day_epoch.toordinal()
+
+
+def get_day_offset(date_str):
+    # 'YYYY-MM-DD' => day
+    return date.fromisoformat(date_str).toordinal() - g_day_epoch_ordinal
+
+
+def get_day_str(day):
+    # day => 'YYYY-MM-DD'
+    return date.fromordinal(g_day_epoch_ordinal + int(day)).isoformat()
+
 ######################
 ## Geography Classes ##########################################################
 
@@ -360,6 +833,7 @@ class State:
     prior_covid19_case = None
     geography = "State"
     unknown_county = None
+    covid19_series = None
 
     def set(self, region, division, state_fips, name):
         self.region = int(region)
@@ -406,18 +880,24 @@ class State:
         return "US"
 
     def get_prior_covid19_case(self):
+        if self.covid19_series is not None:
+            return self.covid19_series.get_prior_covid19_case()
         if self.prior_covid19_case is not None:
             return self.prior_covid19_case
         else:
             return zero_covid19
 
     def get_specific_covid19_case(self, d):
+        if self.covid19_series is not None:
+            return self.covid19_series.get_specific_covid19_case(d)
         if d in self.covid19_cases.keys():
             return self.covid19_cases[d]
         else:
             return zero_covid19
 
     def get_current_covid19_case(self):
+        if self.covid19_series is not None:
+            return self.covid19_series.get_current_covid19_case()
         return self.cur_covid19_case
 
     # Setters
@@ -430,21 +910,19 @@ class State:
         # if self.get_name()=="Florida":
         #   print("Adding %s to %s (%i)"%(c.get_name(),self.get_name(),len(self.counties)))
 
-    def add_covid19_case(self, covid19_case):
-        if covid19_case.case_date not in self.covid19_cases:
-            self.covid19_cases[covid19_case.case_date] = copy.copy(
-                covid19_case)
-        else:
-            self.covid19_cases[covid19_case.case_date].add(covid19_case)
-
-        # todo - should add data logic to make sure data is not out of order
-
-        # if we have a new day of covid19 data, 'current' day is really the prior day
-        if self.cur_covid19_case is not None:
-            if self.cur_covid19_case.case_date != covid19_case.case_date:
-                self.prior_covid19_case = self.cur_covid19_case
+    def set_covid19_cases(self, covid19_cases):
+        # object ingest state totals, one Covid19Stat per reported day in date order - see
+        # Covid19StateTotals
+        self.covid19_cases = dict()
+        for covid19_case in covid19_cases:
+            self.covid19_cases[covid19_case.case_day] = covid19_case
+        self.cur_covid19_case = covid19_cases[-1] if len(covid19_cases) > 0 else None
+        self.prior_covid19_case = covid19_cases[-2] if len(covid19_cases) > 1 else None
 
-        self.cur_covid19_case = self.covid19_cases[covid19_case.case_date]
+    # columnar ingest - covid19 data is a view over a Covid19Matrix row
+    def set_covid19_series(self, covid19_series):
+        self.covid19_series = covid19_series
+        self.covid19_cases = covid19_series
 
     def set_population(self, population):
         self.population = population
@@ -462,7 +940,7 @@ class States:
     states_by_name = dict()
 
     def load_states(self):
-        with open(self.input) as csv_file:
+        with open(self.input, encoding='utf-8') as csv_file:
             csv_data = csv.reader(csv_file)
             for r in csv_data:
                 s = State(r)
@@ -475,7 +953,7 @@ class States:
                 s.set_unknown_county(County(u, self))
 
     def load_population(self):
-        with open(self.pop_input) as csv_file:
+        with open(self.pop_input, encoding='utf-8') as csv_file:
             csv_file.readline()
             csv_data = csv.reader(csv_file)
             for r in csv_data:
@@ -488,11 +966,27 @@ class States:
                 else:
                     state.set_population(state_pop)
 
-    def __init__(self):
+    def load_geography(self, geography):
+        # compiled state-geocodes + nst-est records, see load_geography()
+        for g in geography:
+            s = State([g['region'], g['division'], g['state_fips'],
+                       g['name'].decode('latin-1')])
+            self.states[s.state_fips] = s
+            self.states_by_name[s.name] = s
+
+            u = copy.copy(unknown_county_data)
+            u[1] = s.state_fips
+            s.set_unknown_county(County(u, self))
+            s.set_population(int(g['population']))
+
+    def __init__(self, geography=None):
         self.states = dict()
         self.states_by_name = dict()
-        self.load_states()
-        self.load_population()
+        if geography is None:
+            self.load_states()
+            self.load_population()
+        else:
+            self.load_geography(geography)
 
     def get(self, state_fips):
         if state_fips not in self.states:
@@ -532,11 +1026,12 @@ class County:
     prior_covid19_case = None
     cur_covid19_case = None
     geography = "County"
+    covid19_series = None
 
     def set(self, summary_level, state_fips, county_fips, county_subdivision_fips, place_fips, conslidated_city_fips, area_name):
         self.covid19_cases = []
         self.covid19_cases_inactive = dict()
-        self.covid19_cases_by_date = dict()
+        self.covid19_cases_by_day = dict()
 
         self.summary_level = int(summary_level)
         self.state_fips = int(state_fips)
@@ -549,9 +1044,27 @@ class County:
         # if self.place_fips==0 and self.county_fips!=0:
         self.place_fips = int(state_fips+county_fips)
 
-    def __init__(self, data_row, states):
-        self.set(data_row[0], data_row[1], data_row[2],
-                 data_row[3], data_row[4], data_row[5], data_row[6])
+    def set_geography(self, fips, summary_level, state_fips, county_fips, county_subdivision_fips, conslidated_city_fips, area_name, population):
+        # compiled geography record, see load_geography(); values are already ints
+        self.covid19_cases = []
+        self.covid19_cases_inactive = dict()
+        self.covid19_cases_by_day = dict()
+
+        self.summary_level = summary_level
+        self.state_fips = state_fips
+        self.county_fips = county_fips
+        self.county_subdivision_fips = county_subdivision_fips
+        self.conslidated_city_fips = conslidated_city_fips
+        self.name = area_name
+        self.place_fips = fips
+        self.population = population
+
+    def __init__(self, data_row, states, compiled=False):
+        if compiled:
+            self.set_geography(*data_row)
+        else:
+            self.set(data_row[0], data_row[1], data_row[2],
+                     data_row[3], data_row[4], data_row[5], data_row[6])
 
         # link state and counties together
         self.state = states.get(self.state_fips)
@@ -566,45 +1079,45 @@ class County:
         self.population = int(estimated_population)
 
     def add_covid19_case(self, covid19_case):
+        # covid19_case is stored once & shared by cur / list / by date - it must not change afterwards
         self.prior_covid19_case = self.cur_covid19_case
 
-        # inactive covid19 handling
-        idx = g_active_date_map[covid19_case.case_date]
-        self.covid19_cases_inactive[idx] = copy.copy(covid19_case)
+        # inactive covid19 handling - only the case count is needed g_days from now
+        day = covid19_case.case_day
+        self.covid19_cases_inactive[day + g_days] = covid19_case.case_count
 
-        if covid19_case.case_date in self.covid19_cases_inactive:
-            covid19_case.active_count = covid19_case.case_count - \
-                self.covid19_cases_inactive[covid19_case.case_date].case_count
-        else:
-            covid19_case.active_count = covid19_case.case_count
+        covid19_case.active_count = covid19_case.case_count - \
+            self.covid19_cases_inactive.get(day, 0)
 
-        self.cur_covid19_case = copy.copy(covid19_case)
+        self.cur_covid19_case = covid19_case
         self.covid19_cases.append(covid19_case)
-        self.covid19_cases_by_date[covid19_case.case_date] = copy.copy(
-            covid19_case)
-
-        if self.state is not None:
-            self.state.add_covid19_case(covid19_case)
-        else:
-            dbg("County %s has unknown state" % (self.name))
+        self.covid19_cases_by_day[day] = covid19_case
 
     def has_covid19(self):
         return len(self.covid19_cases) > 0
 
+    # columnar ingest - covid19 data is a view over a Covid19Matrix row
+    def set_covid19_series(self, covid19_series):
+        self.covid19_series = covid19_series
+        self.covid19_cases = covid19_series
+
     def get_prior_covid19_case(self):
+        if self.covid19_series is not None:
+            return self.covid19_series.get_prior_covid19_case()
         if self.prior_covid19_case is None:
             return zero_covid19
         else:
             return self.prior_covid19_case
 
     def get_current_covid19_case(self):
+        if self.covid19_series is not None:
+            return self.covid19_series.get_current_covid19_case()
         return self.cur_covid19_case
 
-    def get_specific_covid19_case(self, d):
-        if d in self.covid19_cases_by_date.keys():
-            return self.covid19_cases_by_date[d]
-        else:
-            return zero_covid19
+    def get_specific_covid19_case(self, day):
+        if self.covid19_series is not None:
+            return self.covid19_series.get_specific_covid19_case(day)
+        return self.covid19_cases_by_day.get(day, zero_covid19)
 
     def get_name(self):
         return self.name
@@ -633,17 +1146,32 @@ class Counties:
     counties_by_fips = dict()
     counties_for_pop_est = dict()
 
-    def __init__(self, states):
+    def __init__(self, states, geography=None):
+        self.states = states
         self.counties_by_fips = dict()
         self.counties_for_pop_est = dict()
         self.counties_by_name = dict()
-        with open(self.input) as csv_file:
+        self.all_counties = []  # csv only, every all-geocodes row in file order
+        self.geography = geography
+        self.pop_est_rows = dict()  # geography only, state fips => county name => geography row
+        self.pop_est_counties = dict()  # geography only, geography row => County
+
+        if geography is None:
+            self.load_counties()
+        else:
+            self.load_geography()
+
+    def load_counties(self):
+        states = self.states
+        # latin-1: Census names such as Doña Ana County
+        with open(self.input, encoding='latin-1') as csv_file:
             csv_data = csv.reader(csv_file)
             for r in csv_data:
                 # 010,00,000,00000,00000,00000,United States
                 # 040,01,000,00000,00000,00000,Alabama
                 # print(r)
                 c = County(r, states)
+                self.all_counties.append(c)
                 if c.state is not None:
                     c.state.add_county(c)
                     # if c.state.get_name()=="Florida":
@@ -663,6 +1191,43 @@ class Counties:
 
                     self.counties_for_pop_est[state_fips][c.name] = c
 
+    def get_counties_from_geography(self, rows):
+        g = self.geography[rows]
+        counties = []
+        for (fips, summary_level, state_fips, county_fips, county_subdivision_fips, conslidated_city_fips,
+             name, population, pop_est) in g.tolist():
+            counties.append(County((fips, summary_level, state_fips, county_fips, county_subdivision_fips,
+                                    conslidated_city_fips, name.decode('latin-1'), population),
+                                   self.states, compiled=True))
+        return counties
+
+    def load_geography(self):
+        # Only the first row of each fips (the one NYT data joins to) becomes a County up front;
+        # the rest of the ~43k rows are created on demand by get_for_pop_est().
+        import numpy as np
+        fips = self.geography['fips']
+        first_rows = np.flatnonzero(np.r_[True, fips[1:] != fips[:-1]])
+        for (row, c) in zip(first_rows.tolist(), self.get_counties_from_geography(first_rows)):
+            if c.state is not None:
+                c.state.add_county(c)
+            self.counties_by_fips[c.place_fips] = c
+            self.pop_est_counties[row] = c
+
+    def get_pop_est_rows(self, state_fips):
+        # county name => geography row, built per state on first use
+        import numpy as np
+        if state_fips not in self.pop_est_rows:
+            g = self.geography
+            rows = np.flatnonzero(g['pop_est'] & (g['state_fips'] == state_fips))
+            names = [name.decode('latin-1') for name in g['name'][rows].tolist()]
+            self.pop_est_rows[state_fips] = dict(zip(names, rows.tolist()))
+        return self.pop_est_rows[state_fips]
+
+    def get_names_for_pop_est(self, state_fips):
+        if self.geography is None:
+            return self.counties_for_pop_est.get(state_fips, dict()).keys()
+        return self.get_pop_est_rows(state_fips).keys()
+
     def get(self, place_fips):
         fips = int(place_fips)
         if fips not in self.counties_by_fips.keys():
@@ -670,6 +1235,15 @@ class Counties:
         return self.counties_by_fips[place_fips]
 
     def get_for_pop_est(self, state_fips, county_name):
+        if self.geography is not None:
+            pop_est_rows = self.get_pop_est_rows(state_fips)
+            if county_name not in pop_est_rows:
+                return None
+            row = pop_est_rows[county_name]
+            if row not in self.pop_est_counties:
+                self.pop_est_counties[row] = self.get_counties_from_geography([row])[0]
+            return self.pop_est_counties[row]
+
         if state_fips not in self.counties_for_pop_est:
             return None
         if county_name not in self.counties_for_pop_est[state_fips]:
@@ -678,9 +1252,12 @@ class Counties:
         return self.counties_for_pop_est[state_fips][county_name]
 
 
+g_county_pop_input = "co-est2019-annres.csv"
+
+
 def set_county_population(states, counties):
-    input = "co-est2019-annres.csv"
-    with open(input) as csv_file:
+    input = g_county_pop_input
+    with open(input, encoding='utf-8') as csv_file:
         csv_data = csv.reader(csv_file)
         for r in csv_data:
             location_name = r[0]
@@ -704,7 +1281,99 @@ def set_county_population(states, counties):
                         county.set_population(population)
 
 
-def validate_custom_geographies(states, counties):
+####################
+## Geography Cache ############################################################
+
+# Census geography & population never change, yet parsing them (43k County objects) dominated
+# "Load geography".  The parsed result is compiled into g_geography_cache_path:
+#   manifest.json - sha1 of each census csv; any mismatch triggers a rebuild
+#   states.npy    - one record per state-geocodes row, file order
+#   counties.npy  - one record per all-geocodes row, sorted by fips (stable)
+# .npy files are memory mapped, and County objects are only created for rows NYT data can join to.
+
+g_geography_cache_path = g_cache_path / "geography"
+g_geography_cache_version = 1
+
+g_geography_state_dtype = [('region', 'i4'),
+                           ('division', 'i4'),
+                           ('state_fips', 'i4'),
+                           ('name', 'S64'),
+                           ('population', 'i8')]
+
+g_geography_county_dtype = [('fips', 'i8'),  # state fips + county fips, aka County.place_fips
+                            ('summary_level', 'i4'),
+                            ('state_fips', 'i4'),
+                            ('county_fips', 'i4'),
+                            ('county_subdivision_fips', 'i4'),
+                            ('conslidated_city_fips', 'i4'),
+                            ('name', 'S64'),
+                            ('population', 'i8'),
+                            ('pop_est', '?')]  # row is the population estimate target for its name
+
+
+def get_geography_sources():
+    sources = dict()
+    for fn in [States.input, States.pop_input, Counties.input, g_county_pop_input]:
+        with open(fn, 'rb') as f:
+            sources[fn] = hashlib.sha1(f.read()).hexdigest()
+    return sources
+
+
+def save_geography(states, counties, sources):
+    import numpy as np
+    state_data = np.array([(s.region, s.division, s.state_fips, s.name.encode('latin-1'), s.population)
+                           for s in states.states_by_name.values()],
+                          dtype=g_geography_state_dtype)
+
+    pop_est = set()
+    for county_by_name in counties.counties_for_pop_est.values():
+        for c in county_by_name.values():
+            pop_est.add(id(c))
+    county_data = np.array([(c.place_fips, c.summary_level, c.state_fips, c.county_fips,
+                             c.county_subdivision_fips, c.conslidated_city_fips,
+                             c.name.encode('latin-1'), c.population, id(c) in pop_est)
+                            for c in counties.all_counties],
+                           dtype=g_geography_county_dtype)
+    county_data = county_data[np.argsort(county_data['fips'], kind='stable')]
+
+    g_geography_cache_path.mkdir(parents=True, exist_ok=True)
+    np.save(g_geography_cache_path / "states.npy", state_data)
+    np.save(g_geography_cache_path / "counties.npy", county_data)
+    # manifest last - it marks the cache as complete
+    with open(g_geography_cache_path / "manifest.json", 'w') as f:
+        json.dump({'version': g_geography_cache_version, 'sources': sources}, f, indent=4)
+
+
+def load_geography():
+    import numpy as np
+    sources = get_geography_sources()
+
+    manifest = dict()
+    manifest_path = g_geography_cache_path / "manifest.json"
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if manifest.get('version') == g_geography_cache_version and manifest.get('sources') == sources:
+        try:
+            state_data = np.load(g_geography_cache_path / "states.npy", mmap_mode='r')
+            county_data = np.load(g_geography_cache_path / "counties.npy", mmap_mode='r')
+            states = States(state_data)
+            counties = Counties(states, county_data)
+            return (states, counties)
+        except Exception as e:
+            dbg("geography cache - unable to load %s: %s" % (g_geography_cache_path, e))
+
+    dbg("geography cache - rebuilding %s" % (g_geography_cache_path))
+    states = States()
+    counties = Counties(states)
+    set_county_population(states, counties)
+    save_geography(states, counties, sources)
+    return (states, counties)
+
+
+def validate_custom_geographies(states, counties, file=None):
+    # errors are printed to file, default sys.stdout
     if not g_json_validate:
         return
 
@@ -725,89 +1394,239 @@ def validate_custom_geographies(states, counties):
                 # Validate state
                 if state_abbr not in g_state_abbr:
                     # Bad state
-                    print()
-                    print()
-                    print(f"Error - Invalid state in {g_json_path}")
+                    print(file=file)
+                    print(file=file)
+                    print(f"Error - Invalid state in {g_json_path}", file=file)
                     print(
-                        f"        -> spreadsheets.custom.{custom_xlsx} = [ ... \"{geography}\" ... ] <-")
+                        f"        -> spreadsheets.custom.{custom_xlsx} = [ ... \"{geography}\" ... ] <-", file=file)
                     print(
-                        f"        {geography} has an unknown state abbreviation [{state_abbr}]")
+                        f"        {geography} has an unknown state abbreviation [{state_abbr}]", file=file)
                     print(
-                        f"        State abbreviation must be one of: {g_state_abbr}")
-                    print()
+                        f"        State abbreviation must be one of: {g_state_abbr}", file=file)
+                    print(file=file)
                     has_err = True
                 else:
                     # Validate county
                     state_fips = states.states_by_name[g_state_name[state_abbr]].state_fips
-                    county_list = counties.counties_for_pop_est[state_fips]
+                    county_list = counties.get_names_for_pop_est(state_fips)
                     if county not in county_list:
                         # Bad county
                         # Filter valid County geographies to those that include the string "County"
                         valid_counties = sorted(
-                            [county for county in county_list.keys() if "County" in county])
-                        print()
-                        print()
-                        print(f"Error - Invalid county in {g_json_path}")
+                            [county for county in county_list if "County" in county])
+                        print(file=file)
+                        print(file=file)
+                        print(f"Error - Invalid county in {g_json_path}", file=file)
                         print(
-                            f"        -> spreadsheets.custom.{custom_xlsx} = [ ... \"{geography}\" ... ] <-")
+                            f"        -> spreadsheets.custom.{custom_xlsx} = [ ... \"{geography}\" ... ] <-", file=file)
                         print(
-                            f"        {geography} has an unknown county [{county}]")
-                        print(f"      {state_abbr} counties must be one of:")
-                        print(f"{valid_counties}")
-                        print()
+                            f"        {geography} has an unknown county [{county}]", file=file)
+                        print(f"      {state_abbr} counties must be one of:", file=file)
+                        print(f"{valid_counties}", file=file)
+                        print(file=file)
                         has_err = True
 
     if has_err:
-        print(f"Please update {g_json_path} and try again!")
-        abort()
+        print(f"Please update {g_json_path} and try again!", file=file)
+        abort(file)
 
 ##########################
 ## Covid Case Statistics ######################################################
 
 
 class Covid19Stat:
-    case_date = ''
-    case_count = 0
-    death_count = 0
-    active_count = 0
+    # one per NYT row (object ingest) - keep it small
+    __slots__ = ('case_day', 'case_count', 'death_count', 'active_count')
 
-    def __init__(self, case_date, case_count, death_count):
-        # self.date=datetime.datetime.strptime(case_date,"%Y-%m-%d")
+    def __init__(self, case_day, case_count, death_count):
+        # case_day - see get_day_offset()
         if (death_count == ''):
             death_count = 0
         if (case_count == ''):
             case_count = 0
 
-        self.case_date = case_date
+        self.case_day = case_day
         self.case_count = int(case_count)
         self.death_count = int(death_count)
         self.active_count = 0
 
     def get_csv_output(self):
-        return "%s,%i,%i" % (self.case_date, self.case_count, self.death_count)
-
-    def add(self, covid19_case):
-        self.case_count += covid19_case.case_count
-        self.death_count += covid19_case.death_count
-        self.active_count += covid19_case.active_count
+        return "%s,%i,%i" % (get_day_str(self.case_day), self.case_count, self.death_count)
 
 
 # Used for the prior day of the first day of a case.
-zero_covid19 = Covid19Stat('1900-01-01', 0, 0)
+zero_covid19 = Covid19Stat(get_day_offset('1900-01-01'), 0, 0)
+
+######################
+## Predicate Pushdown #########################################################
+
+# Spreadsheets rarely need every NYT row.  From g_conf['spreadsheets']:
+#   detail - county level data: each county of a state-detail state, each custom county,
+#            every county when "us-counties" is true
+#   total  - state totals only: each custom state, every state when "us" is true
+# Anything else is skipped at ingest, before a Covid19Stat is created.
+
+
+class IngestFilter:
+    def __init__(self):
+        self.detail_fips = set()  # county fips
+        self.detail_states = set()  # state fips
+        self.total_states = set()  # state fips
+
+    def get_mode(self, county):
+        # "detail", "total" or None (skip) for NYT rows received by county
+        if county is None:
+            return None
+        state = county.get_state()
+        if county.get_fips() in self.detail_fips:
+            return "detail"
+        if state is None:
+            return None
+        if state.get_fips() in self.detail_states:
+            return "detail"
+        if state.get_fips() in self.total_states:
+            return "total"
+        return None
+
+    def has_state_total(self, state):
+        # True when every NYT row of state is ingested
+        return state.get_fips() in self.detail_states or state.get_fips() in self.total_states
+
+
+def get_ingest_filter(states, counties):
+    # None - ingest everything
+    if not g_ingest_pushdown:
+        return None
+
+    # every configuration's spreadsheets - one in batch mode
+    ingest_filter = IngestFilter()
+    for (conf_path, conf) in g_confs:
+        spreadsheets = conf['spreadsheets']
+        if spreadsheets.get('us', False):
+            ingest_filter.total_states.update(
+                [s.get_fips() for s in states.states.values() if s.get_fips() != 0])
+        if spreadsheets.get('us-counties', False):
+            ingest_filter.detail_states.update(
+                [s.get_fips() for s in states.states.values() if s.get_fips() != 0])
+
+        for state_abbr in spreadsheets['state-detail']:
+            ingest_filter.detail_states.add(
+                states.get_by_name(g_state_name[state_abbr]).get_fips())
+
+        for custom_xlsx in spreadsheets['custom']:
+            for geography in spreadsheets['custom'][custom_xlsx]:
+                if len(geography) == 2:
+                    ingest_filter.total_states.add(
+                        states.get_by_name(g_state_name[geography]).get_fips())
+                else:
+                    ingest_filter.detail_fips.add(
+                        get_county_id(states, counties, geography).get_fips())
+
+    return ingest_filter
+
+
+def filter_covid19_lines(csv_lines, states, counties, ingest_filter):
+    # Drop unneeded us-counties.csv lines before csv parsing.  Lines are keyed by their
+    # "county,state,fips" text - everything between the date and the (never quoted) counts.
+    keep_by_key = dict()
+    for line in csv_lines:
+        key = line[11:line.rfind(',', 0, line.rfind(','))]
+        keep = keep_by_key.get(key)
+        if keep is None:
+            r = next(csv.reader([line]))
+            county = get_covid19_row_location(states, counties, r[2], r[3])
+            keep = ingest_filter.get_mode(county) is not None
+            keep_by_key[key] = keep
+        if keep:
+            yield line
+
+
+class Covid19StateTotals:
+    # Object ingest state totals.  The ingest loop only records each county row's (state, day,
+    # cases, deaths); set_states() sums them by state and day in one reduction, as the columnar
+    # engine does (Covid19Matrix.group_by), so totals do not depend on NYT row order.  Active cases
+    # are a linear function of cases, computed on the totals.
+
+    def __init__(self, states):
+        self.all_states = sorted([s for s in states.states.values() if s.get_fips() != 0],
+                                 key=lambda x: x.get_fips())
+        self.row_by_fips = dict()
+        for row, state in enumerate(self.all_states):
+            self.row_by_fips[state.get_fips()] = row
+        self.rows = array('i')
+        self.days = array('i')
+        self.cases = array('i')
+        self.deaths = array('i')
+
+    def add(self, county, covid19_case):
+        state = county.get_state()
+        row = None if state is None else self.row_by_fips.get(state.get_fips())
+        if row is None:
+            dbg("County %s has unknown state" % (county.get_name()))
+            return
+
+        self.rows.append(row)
+        self.days.append(covid19_case.case_day)
+        self.cases.append(covid19_case.case_count)
+        self.deaths.append(covid19_case.death_count)
+
+    def set_states(self):
+        import numpy as np
+        matrix = Covid19Matrix(self.all_states, 0)
+        add_covid19_rows(matrix, (np.frombuffer(self.rows, dtype=np.int32),
+                                  np.frombuffer(self.days, dtype=np.int32),
+                                  np.frombuffer(self.cases, dtype=np.int32),
+                                  np.frombuffer(self.deaths, dtype=np.int32)))
+        matrix.calc_active(g_days)
+
+        for (row, state) in enumerate(self.all_states):
+            covid19_cases = []
+            for day in np.flatnonzero(matrix.reported[row]).tolist():
+                covid19_case = Covid19Stat(day, matrix.cases[row, day],
+                                           matrix.deaths[row, day])
+                covid19_case.active_count = int(matrix.active[row, day])
+                covid19_cases.append(covid19_case)
+            state.set_covid19_cases(covid19_cases)
 
 
 def set_county_covid19_cases(states, counties):
+    ingest_filter = get_ingest_filter(states, counties)
+    mode_by_key = dict()  # (fips or state name) => (County, ingest mode)
+    day_by_date = dict()  # NYT repeats dates constantly
+    state_totals = Covid19StateTotals(states)
+
     input = g_covid19_data_path / "us-counties.csv"
     with open(input) as csv_file:
         csv_file.readline()  # skip first line
-        csv_data = csv.reader(csv_file)
+        csv_lines = csv_file
+        if ingest_filter is not None:
+            csv_lines = filter_covid19_lines(csv_file, states, counties, ingest_filter)
+        csv_data = csv.reader(csv_lines)
         for r in csv_data:
             #date,        county,     state,       fips,   cases,deaths
             # 2020-01-21,  Snohomish,  Washington,  53061,  1,    0
             #r[0],      r[1],       r[2],        r[3],   r[4], r[5]
 
+            day = day_by_date.get(r[0])
+            if day is None:
+                day = get_day_offset(r[0])
+                day_by_date[r[0]] = day
+
+            if ingest_filter is not None:
+                key = r[3] or r[2]
+                county_mode = mode_by_key.get(key)
+                if county_mode is None:
+                    county = get_covid19_row_location(states, counties, r[2], r[3])
+                    county_mode = (county, ingest_filter.get_mode(county))
+                    mode_by_key[key] = county_mode
+                if county_mode[1] is None:
+                    continue
+                if county_mode[1] == "total":
+                    state_totals.add(county_mode[0], Covid19Stat(day, r[4], r[5]))
+                    continue
+
             # try:
-            covid_case = Covid19Stat(r[0], r[4], r[5])
+            covid_case = Covid19Stat(day, r[4], r[5])
             # except ValueError:
             #    print('error!')
             #    print(r)
@@ -830,8 +1649,10 @@ def set_county_covid19_cases(states, counties):
                             (covid_county, covid_state, covid_fips))
                     else:
                         state.unknown_county.add_covid19_case(covid_case)
+                        state_totals.add(state.unknown_county, covid_case)
                 else:
                     county.add_covid19_case(covid_case)
+                    state_totals.add(county, covid_case)
 
                     # county trap
                     # if covid_county == 'Burleigh':
@@ -842,33 +1663,969 @@ def set_county_covid19_cases(states, counties):
                 state = states.get_by_name(covid_state)
                 if state is not None:
                     state.unknown_county.add_covid19_case(covid_case)
+                    state_totals.add(state.unknown_county, covid_case)
                 else:
                     dbg("covid19 case data - missing fips and uknown state %s, %s (%s)" %
                         (covid_county, covid_state, covid_fips))
 
+    state_totals.set_states()
+
+##########################
+## Columnar Covid Ingest ######################################################
+
+# Rather than create a Covid19Stat per NYT row, the columnar engine parses us-counties.csv
+# into dense (geography x day) int32 matrices - cases, deaths, active.
+#
+#   row    - one per County (or State), sorted by fips
+#   column - day, see get_day_offset()
+#
+# County / State objects are handed a Covid19Series, a thin view over their matrix row,
+# so XLSX and the get_*_covid19_case() accessors keep working as-is.
+#
+# Note: NYT rows which map to the same county on the same day (eg Unknown County) are summed.
+
+class Covid19Matrix:
+    def __init__(self, locations, n_days):
+        # locations must be sorted by fips
+        import numpy as np
+        self.locations = locations
+        self.fips = np.array([loc.get_fips() for loc in locations], dtype=np.int64)
+        self.row_by_fips = dict()
+        for row, fips in enumerate(self.fips.tolist()):
+            self.row_by_fips[fips] = row
+
+        self.n_days = n_days
+        shape = (len(locations), n_days)
+        self.cases = np.zeros(shape, dtype=np.int32)
+        self.deaths = np.zeros(shape, dtype=np.int32)
+        self.active = np.zeros(shape, dtype=np.int32)  # active cases for g_days, see calc_active()
+        self.active_by_days = dict()  # case duration => active cases
+        self.reported = np.zeros(shape, dtype=bool)  # True when NYT has a row for geography/day
+        self.metrics = dict()  # derived metric => (geography x day) values, see Covid19Metrics
+        self.trend = None  # summary trend label of each geography's latest reported day
+
+    def resize(self, n_days):
+        # grow day columns; new days are unreported
+        import numpy as np
+        if n_days <= self.n_days:
+            return
+        pad = ((0, 0), (0, n_days-self.n_days))
+        self.cases = np.pad(self.cases, pad)
+        self.deaths = np.pad(self.deaths, pad)
+        self.active = np.pad(self.active, pad)
+        self.reported = np.pad(self.reported, pad)
+        self.n_days = n_days
+
+    def clear(self, day=None):
+        # zero a single day, or everything
+        if day is None:
+            day = slice(None)
+        self.cases[:, day] = 0
+        self.deaths[:, day] = 0
+        self.active[:, day] = 0
+        self.reported[:, day] = False
+
+    def get_row(self, fips):
+        if fips not in self.row_by_fips:
+            return None
+        return self.row_by_fips[fips]
+
+    def add_covid19_cases(self, rows, days, cases, deaths):
+        import numpy as np
+        np.add.at(self.cases, (rows, days), cases)
+        np.add.at(self.deaths, (rows, days), deaths)
+        self.reported[rows, days] = True
+
+    def calc_active(self, days, days_sweep=()):
+        # Active = YTD (Today) - YTD (days ago); unreported days are 0, same as object ingest.
+        # One shifted difference per case duration, covering every geography at once.
+        self.active_by_days = dict()
+        for d in sorted(set([days]) | set(days_sweep)):
+            active = self.cases.copy()
+            if d < self.n_days:
+                active[:, d:] -= self.cases[:, :-d]
+            self.active_by_days[d] = active
+        self.active = self.active_by_days[days]
+
+    def group_by(self, locations, group_rows):
+        # Sum rows into locations; group_rows[i] is the output row of self row i, or -1 to drop
+        # Active cases are a linear function of cases - call calc_active() on the result.
+        import numpy as np
+        grouped = Covid19Matrix(locations, self.n_days)
+        keep = group_rows >= 0
+        rows = group_rows[keep]
+        np.add.at(grouped.cases, rows, self.cases[keep])
+        np.add.at(grouped.deaths, rows, self.deaths[keep])
+        np.logical_or.at(grouped.reported, rows, self.reported[keep])
+        return grouped
+
+    def set_covid19_series(self):
+        for row, loc in enumerate(self.locations):
+            loc.set_covid19_series(Covid19Series(self, row))
+
+
+class Covid19Series:
+    # Read only view of one Covid19Matrix row, presented as a sequence of Covid19Stat
+
+    def __init__(self, matrix, row):
+        import numpy as np
+        self.matrix = matrix
+        self.row = row
+        self.days = np.flatnonzero(matrix.reported[row])
+
+    def __len__(self):
+        return len(self.days)
+
+    def __iter__(self):
+        for day in self.days:
+            yield self.get_day_covid19_case(day)
+
+    def get_day_covid19_case(self, day):
+        m = self.matrix
+        covid19_case = Covid19Stat(int(day),
+                                   m.cases[self.row, day],
+                                   m.deaths[self.row, day])
+        covid19_case.active_count = int(m.active[self.row, day])
+        return covid19_case
+
+    def get_active_counts(self, days):
+        # active cases for a case duration, one per reported day
+        return self.matrix.active_by_days[days][self.row, self.days]
+
+    def get_counts(self):
+        # (cases, deaths, active) arrays, one entry per reported day
+        m = self.matrix
+        return (m.cases[self.row, self.days], m.deaths[self.row, self.days], m.active[self.row, self.days])
+
+    def get_metrics(self, names):
+        # derived metric arrays, one entry per reported day
+        return [self.matrix.metrics[name][self.row, self.days] for name in names]
+
+    def get_trend(self):
+        # (weekly average, trend label) of the latest reported day
+        return (float(self.matrix.metrics['wkly_avg'][self.row, self.days[-1]]), str(self.matrix.trend[self.row]))
+
+    def get_current_covid19_case(self):
+        if len(self.days) == 0:
+            return None
+        return self.get_day_covid19_case(self.days[-1])
+
+    def get_prior_covid19_case(self):
+        if len(self.days) < 2:
+            return zero_covid19
+        return self.get_day_covid19_case(self.days[-2])
+
+    def get_specific_covid19_case(self, day):
+        if day < 0 or day >= self.matrix.n_days or not self.matrix.reported[self.row, day]:
+            return zero_covid19
+        return self.get_day_covid19_case(day)
+
+
+def get_covid19_counts(location):
+    # (cases, deaths, active) arrays for any State/County, one entry per reported day
+    import numpy as np
+    if location.covid19_series is not None:
+        return location.covid19_series.get_counts()
+
+    covid19_cases = location.covid19_cases
+    if isinstance(covid19_cases, dict):
+        covid19_cases = covid19_cases.values()  # State, by day
+
+    cases = []
+    deaths = []
+    active = []
+    for covid_case in covid19_cases:
+        cases.append(covid_case.case_count)
+        deaths.append(covid_case.death_count)
+        active.append(covid_case.active_count)
+    return (np.array(cases, dtype=np.int64), np.array(deaths, dtype=np.int64), np.array(active, dtype=np.int64))
+
+
+def get_covid19_days(location):
+    # reported days of any State/County, matching get_covid19_counts()
+    import numpy as np
+    if location.covid19_series is not None:
+        return location.covid19_series.days
+
+    covid19_cases = location.covid19_cases
+    if isinstance(covid19_cases, dict):
+        return np.array(list(covid19_cases.keys()), dtype=np.int64)  # State, by day
+    return np.array([covid_case.case_day for covid_case in covid19_cases], dtype=np.int64)
+
+
+def get_covid19_row_location(states, counties, covid_state, covid_fips):
+    # NYT fips/state => County receiving the case, mirroring set_county_covid19_cases()
+    state = None
+    if len(covid_fips) != 0:
+        county = counties.get(int(covid_fips))
+        if county is not None:
+            return county
+        dbg("covid19 case data - unknown county %s (%s)" %
+            (covid_state, covid_fips))
+
+    state = states.get_by_name(covid_state.strip())
+    if state is None:
+        dbg("covid19 case data - unknown state %s (%s)" %
+            (covid_state, covid_fips))
+        return None
+    return state.unknown_county
+
+
+def get_covid19_locations(states, counties, ingest_filter=None):
+    # Every county with a state can receive data, including each state's Unknown County
+    # state fips 0 is a census region / division, not a state
+    #
+    # With an IngestFilter, only "detail" counties get a row; a State needing only its total gets
+    # one row for all its other counties (state fips never collide with county fips).
+    all_states = sorted([s for s in states.states.values() if s.get_fips() != 0],
+                        key=lambda x: x.get_fips())
+    locations = []
+    for s in all_states:
+        mode = "detail" if ingest_filter is None else ingest_filter.get_mode(s.unknown_county)
+        if mode == "detail":
+            locations.append(s.unknown_county)
+        elif mode == "total":
+            locations.append(s)
+    for county in counties.counties_by_fips.values():
+        state = county.get_state()
+        if state is not None and state.get_fips() != 0:
+            if ingest_filter is None or ingest_filter.get_mode(county) == "detail":
+                locations.append(county)
+    locations.sort(key=lambda x: x.get_fips())
+    return (all_states, locations)
+
+
+def read_covid19_rows(csv_data, states, counties, matrix):
+    # NYT csv rows => (matrix rows, days, cases, deaths) int32 arrays
+    import numpy as np
+
+    # (fips or state name) => matrix row, and date => day; NYT repeats both constantly
+    row_by_key = dict()
+    day_by_date = dict()
+
+    rows = array('i')
+    days = array('i')
+    cases = array('i')
+    deaths = array('i')
+
+    for r in csv_data:
+        #date,        county,     state,       fips,   cases,deaths
+        #r[0],      r[1],       r[2],        r[3],   r[4], r[5]
+        key = r[3] or r[2]
+        row = row_by_key.get(key)
+        if row is None:
+            loc = get_covid19_row_location(states, counties, r[2], r[3])
+            row = -1
+            if loc is not None:
+                row = matrix.get_row(loc.get_fips())
+                if row is None and loc.get_state() is not None:
+                    # state total only, see get_covid19_locations()
+                    row = matrix.get_row(loc.get_state().get_fips())
+                if row is None:
+                    row = -1
+            row_by_key[key] = row
+        if row < 0:
+            continue
+
+        day = day_by_date.get(r[0])
+        if day is None:
+            day = get_day_offset(r[0])
+            day_by_date[r[0]] = day
+
+        rows.append(row)
+        days.append(day)
+        cases.append(int(r[4]) if r[4] else 0)
+        deaths.append(int(r[5]) if r[5] else 0)
+
+    return (np.frombuffer(rows, dtype=np.int32),
+            np.frombuffer(days, dtype=np.int32),
+            np.frombuffer(cases, dtype=np.int32),
+            np.frombuffer(deaths, dtype=np.int32))
+
+
+def add_covid19_rows(matrix, covid19_rows):
+    (rows, days, cases, deaths) = covid19_rows
+    if len(days) > 0:
+        matrix.resize(int(days.max()) + 1)
+    matrix.add_covid19_cases(rows, days, cases, deaths)
+
+#########################
+## Incremental Ingest ##########################################################
+
+# The county matrix is persisted to g_covid19_store_path along with:
+#   commit    - NYT git HEAD at time of ingest
+#   last_date - newest date ingested
+#   offset    - us-counties.csv byte offset at end of ingest
+#
+# On the next run:
+#   * same commit, same file          - nothing to parse
+#   * new commit, appended rows only  - seek to offset, parse the new rows
+#   * new commit, revised older rows  - dates found via git diff are cleared & re-ingested;
+#                                       every other row is skipped without being parsed
+#   * anything else                   - full ingest
+#
+# Saving is append-only: a run writes just the day columns it changed - first_day onwards - to a
+# chunk file next to g_covid19_store_path (us-counties.1.npz, us-counties.2.npz, ...), so a daily
+# refresh writes about one day of data.  load() applies the base file, then each chunk in order.
+# A full ingest, or g_covid19_store_chunks chunks, rewrites the base and drops the chunks; chunks
+# name their base, so any left over from an older base are ignored.
+
+g_covid19_store_chunks = 30
+
+
+class Covid19Store:
+    def __init__(self, path, csv_path):
+        self.path = Path(path)
+        self.csv_path = Path(csv_path)
+        self.meta = dict()
+        self.prior_meta = dict()  # meta before ingest()
+        self.first_day = 0  # earliest day ingest() changed; matrix.n_days when nothing changed
+        self.base = None  # id of the stored base file
+        self.chunks = 0  # chunks applied on top of the base
+        self.matrix = None
+
+    def get_chunk_path(self, n):
+        return self.path.with_name("%s.%i%s" % (self.path.stem, n, self.path.suffix))
+
+    def get_commit(self):
+        try:
+            return get_git_head(self.csv_path.parent)
+        except Exception:
+            return None
+
+    def get_csv_stat(self):
+        st = os.stat(self.csv_path)
+        return (st.st_size, st.st_mtime_ns)
+
+    def load(self, matrix):
+        # Load stored data into matrix; matrix geography must match stored geography
+        import numpy as np
+        if not self.path.exists():
+            return False
+        try:
+            with np.load(self.path, allow_pickle=False) as npz:
+                if not np.array_equal(npz['fips'], matrix.fips):
+                    dbg("covid19 store - geography changed, ignoring %s" % (self.path))
+                    return False
+                self.meta = json.loads(str(npz['meta']))
+                self.base = str(npz['base'])
+                matrix.resize(npz['cases'].shape[1])
+                matrix.cases[:, :] = npz['cases']
+                matrix.deaths[:, :] = npz['deaths']
+                matrix.reported[:, :] = npz['reported']
+
+            self.chunks = 0
+            while self.get_chunk_path(self.chunks + 1).exists():
+                with np.load(self.get_chunk_path(self.chunks + 1), allow_pickle=False) as npz:
+                    if str(npz['base']) != self.base:
+                        break  # left over from an older base
+                    first_day = int(npz['first_day'])
+                    n_days = first_day + npz['cases'].shape[1]
+                    matrix.resize(n_days)
+                    matrix.cases[:, first_day:n_days] = npz['cases']
+                    matrix.deaths[:, first_day:n_days] = npz['deaths']
+                    matrix.reported[:, first_day:n_days] = npz['reported']
+                    self.meta = json.loads(str(npz['meta']))
+                self.chunks += 1
+        except Exception as e:
+            dbg("covid19 store - unable to load %s: %s" % (self.path, e))
+            self.meta = dict()
+            self.base = None
+            return False
+        return True
+
+    def save_npz(self, path, **data):
+        import numpy as np
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(self.meta)), **data)
+        os.replace(tmp_path, path)
+
+    def save(self, matrix, commit, last_date, offset, first_day=0):
+        # first_day - earliest day changed since load(); earlier days are already stored
+        import numpy as np
+        (size, mtime_ns) = self.get_csv_stat()
+        self.meta = {'commit': commit, 'last_date': last_date, 'offset': offset,
+                     'size': size, 'mtime_ns': mtime_ns}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        first_day = min(first_day, matrix.n_days)
+        if first_day > 0 and self.base is not None and self.chunks < g_covid19_store_chunks:
+            self.chunks += 1
+            self.save_npz(self.get_chunk_path(self.chunks), base=np.array(self.base),
+                          first_day=np.array(first_day), cases=matrix.cases[:, first_day:],
+                          deaths=matrix.deaths[:, first_day:], reported=matrix.reported[:, first_day:])
+            return
+
+        self.base = os.urandom(8).hex()
+        self.save_npz(self.path, base=np.array(self.base), fips=matrix.fips, cases=matrix.cases,
+                      deaths=matrix.deaths, reported=matrix.reported)
+        for chunk_path in self.path.parent.glob("%s.*%s" % (self.path.stem, self.path.suffix)):
+            chunk_path.unlink()
+        self.chunks = 0
+
+    def is_local_commit(self, path, commit):
+        # A partial clone (nyt-sync shallow) fetches missing objects on demand: diffing a commit
+        # from before the clone would download its us-counties.csv.  Commits this clone has checked
+        # out are in HEAD's reflog, their csv is local.
+        try:
+            if run_git(path, 'config', '--get', 'remote.origin.promisor') != 'true':
+                return True
+        except GitError:
+            return True  # not set
+        return commit in run_git(path, 'reflog', '--format=%H').split()
+
+    def get_revised_dates(self, commit):
+        # Dates of stored rows changed between the stored commit and commit, or None if unknown
+        try:
+            path = self.csv_path.parent
+            if not self.is_local_commit(path, self.meta['commit']):
+                dbg("covid19 store - %s is not local" % (self.meta['commit']))
+                return None
+            diff = run_git(path, 'diff', '--unified=0', '--no-color',
+                           self.meta['commit'], commit, '--', self.csv_path.name)
+        except Exception as e:
+            dbg("covid19 store - git diff failed: %s" % (e))
+            return None
+
+        last_date = self.meta['last_date']
+        revised = set()
+        for line in diff.splitlines():
+            if line.startswith('---') or line.startswith('+++') or line[:1] not in ('-', '+'):
+                continue
+            d = line[1:11]
+            if d.startswith('date'):
+                dbg("covid19 store - header changed")
+                return None
+            if line.startswith('-') or d <= last_date:
+                revised.add(d)
+        return revised
+
+    def ingest(self, states, counties, matrix, ingest_filter=None):
+        # Bring matrix up to date with csv_path, parsing as little as possible
+        import numpy as np
+        commit = self.get_commit()
+        has_store = self.load(matrix)
+        meta = self.meta
+        self.prior_meta = meta
+        self.first_day = 0
+
+        mode = "full"
+        revised = set()
+        if has_store and commit is not None and meta.get('commit') is not None:
+            if commit == meta['commit']:
+                if self.get_csv_stat() == (meta['size'], meta['mtime_ns']):
+                    mode = "none"
+            else:
+                revised = self.get_revised_dates(commit)
+                if revised is None:
+                    mode = "full"
+                elif len(revised) == 0:
+                    mode = "append"
+                else:
+                    mode = "revise"
+        elif has_store and self.get_csv_stat() == (meta.get('size'), meta.get('mtime_ns')):
+            mode = "none"
+
+        dbg("covid19 store - %s ingest (%s => %s)" % (mode, meta.get('commit'), commit))
+        if mode == "none":
+            self.first_day = matrix.n_days
+            return mode
+
+        last_date = meta.get('last_date', '')
+        if mode == "full":
+            matrix.clear()
+            last_date = ''
+        else:
+            self.first_day = get_day_offset(last_date) + 1 if last_date else 0
+        if mode == "revise":
+            for d in revised:
+                day = get_day_offset(d)
+                self.first_day = max(min(self.first_day, day), 0)
+                if 0 <= day < matrix.n_days:
+                    matrix.clear(day)
+
+        with open(self.csv_path) as csv_file:
+            csv_file.readline()  # skip first line
+            if mode == "append":
+                csv_file.seek(meta['offset'])
+                csv_lines = csv_file
+            else:
+                # date is the first 10 chars of each line; skip untouched rows unparsed
+                csv_lines = (line for line in csv_file
+                             if line[:10] > last_date or line[:10] in revised)
+            if ingest_filter is not None:
+                csv_lines = filter_covid19_lines(csv_lines, states, counties, ingest_filter)
+            covid19_rows = read_covid19_rows(csv.reader(csv_lines), states, counties, matrix)
+            offset = csv_file.tell()
+
+        add_covid19_rows(matrix, covid19_rows)
+
+        n_reported = np.flatnonzero(matrix.reported.any(axis=0))
+        if len(n_reported) > 0:
+            last_date = get_day_str(n_reported[-1])
+        self.save(matrix, commit, last_date, offset, self.first_day)
+        return mode
+
+
+def set_county_covid19_cases_columnar(states, counties):
+    import numpy as np
+    input = g_covid19_data_path / "us-counties.csv"
+
+    ingest_filter = get_ingest_filter(states, counties)
+    (all_states, locations) = get_covid19_locations(states, counties, ingest_filter)
+    county_matrix = Covid19Matrix(locations, 0)
+
+    if g_ingest_store:
+        store = Covid19Store(g_covid19_store_path, input)
+        mode = store.ingest(states, counties, county_matrix, ingest_filter)
+        print(" (%s)" % (mode), end='', flush=True)
+    else:
+        with open(input) as csv_file:
+            csv_file.readline()  # skip first line
+            csv_lines = csv_file
+            if ingest_filter is not None:
+                csv_lines = filter_covid19_lines(csv_file, states, counties, ingest_filter)
+            covid19_rows = read_covid19_rows(csv.reader(csv_lines), states, counties, county_matrix)
+        add_covid19_rows(county_matrix, covid19_rows)
+
+    county_matrix.calc_active(g_days, g_days_sweep)
+    county_metrics = Covid19Metrics(county_matrix, g_covid19_metrics_path / "counties.npz",
+                                    [loc.get_geography() == 'County' for loc in locations])
+
+    # State totals - one reduction over county rows
+    state_row_by_fips = dict()
+    for row, state in enumerate(all_states):
+        state_row_by_fips[state.get_fips()] = row
+    group_rows = np.array([state_row_by_fips[(loc if isinstance(loc, State) else loc.get_state()).get_fips()]
+                           for loc in locations], dtype=np.int64)
+    state_matrix = county_matrix.group_by(all_states, group_rows)
+    state_matrix.calc_active(g_days, g_days_sweep)
+    state_metrics = Covid19Metrics(state_matrix, g_covid19_metrics_path / "states.npz",
+                                   [ingest_filter is None or ingest_filter.has_state_total(state)
+                                    for state in all_states])
+
+    if g_ingest_store:
+        county_metrics.update(store)
+        state_metrics.update(store)
+    else:
+        county_metrics.calc()
+        state_metrics.calc()
+
+    # state totals rows (IngestFilter) in county_matrix are partial; state_matrix's series wins
+    county_matrix.set_covid19_series()
+    state_matrix.set_covid19_series()
+
+    return (county_matrix, state_matrix)
+
+####################
+## Derived Metrics ############################################################
+
+# Spreadsheet series derived from a Covid19Matrix are computed once, for every geography at once:
+#   death_per_capita, cases_per_capita - deaths / cases * per capita scale / population
+#   cfr                                  - deaths / cases * 100
+#   cases_new, deaths_new                - change since the geography's prior reported day
+#   wkly_avg                             - (active - active a week ago) / 7
+#   trend_band                           - g_trend_bands index of every day, see get_covid19_trend_bands()
+#   trend                                - summary trend label of the latest reported day
+#   cases_avg_N, deaths_avg_N ...        - rolling window metrics, one set per case-rolling-windows
+#                                          entry, see get_rolling_metrics()
+#
+# With ingest-store, they are kept in g_covid19_metrics_path (one npz per matrix, one row per
+# geography and metric) along with the settings that produced them - case-days-duration,
+# case-rolling-windows, geography-per-county / state, population - and the Covid19Store revision:
+#   * same revision                   - stored rows are used as-is, new geographies computed
+#   * Covid19Store's previous revision - only days from Covid19Store.first_day are computed
+#   * anything else                   - everything is computed
+# Rows are keyed by fips, so configs sharing a NYT revision share computed geographies.
+
+g_covid19_metrics_version = 3
+g_covid19_metrics_float = ['death_per_capita', 'cfr', 'cases_per_capita', 'wkly_avg']
+g_covid19_metrics_int = ['cases_new', 'deaths_new', 'trend_band']
+
+
+def get_covid19_trend(case_day, active_count, case_count_new, wkly_avg):
+    # summary sheet trend label
+    net_zero = case_count_new - wkly_avg
+    if net_zero != 0:
+        sick_percentage = wkly_avg / net_zero
+    elif wkly_avg != 0:
+        # 100 new cases, 100 wkly avg: 100% sick
+        sick_percentage = 1.0
+    else:
+        # 0 new cases, 0 wkly avg: 0% sick.
+        sick_percentage = 0.0
+    sick_ratio = int(sick_percentage)
+
+    # Identify trend based on weekly avg
+    trend = ""
+    if wkly_avg > -1:  # a positive avg means more infections! Label/
+        if sick_percentage >= 0.9:
+            trend = "UNCONTROLLED"
+        elif sick_percentage >= 0.50:
+            trend = "DANGER ZONE"
+        elif sick_percentage >= 0.25:
+            trend = "ACTIVE SPREAD"
+        elif sick_percentage >= 0.1:
+            trend = "WARNING"
+        else:
+            trend = "CONTROLLED"
+
+        # if we have a daily avg of 200, and a new case count, then today is a test anamoly.
+        if wkly_avg >= case_count_new:
+            if wkly_avg > 1000:
+                trend = "UNCONTROLLED"
+            elif wkly_avg > 500:
+                trend = "DANGER ZONE"
+            elif wkly_avg > 100:
+                trend = "ACTIVE SPREAD"
+            elif wkly_avg > 50:
+                trend = "WARNING"
+            elif wkly_avg > 10:
+                trend = "TRYING"
+            else:
+                trend = "CONTROLLED"
+
+        # If case_count = 100, and 25 people are daily avg, then 75 people who got sick replace people just getting healthy.
+        # this 75 is the "net_zero" -- the virus is not going up nor down, but staying the same.
+
+        trend_summary = ""
+        if net_zero > 0:
+            # if case_count = 100, daily_avg = 50:
+            #   50 people got better
+            #   50 people got sick
+            #   50 more people got sick
+            #  then sick to healthy ratio is 1:1
+            # if case_count = 100, daily_avg = 75, then:
+            #   25 people got better
+            #   25 people got sick
+            #   75 more people got sick
+            #  for each net_zero, 3 more people got sick
+
+            if sick_ratio >= 1:
+                sick_ratio = sick_ratio+1
+                trend_summary = f"{sick_ratio}:1 growth"
+            else:
+                trend_summary = "+{0:.0%} growth".format(
+                    sick_percentage)
+        else:
+            trend_summary = "n/a"
+
+        trend = f"{trend} [{trend_summary}]"
+
+    else:
+        cure_days = int(active_count/abs(wkly_avg))
+        cure_date = get_day_str(case_day + cure_days)
+        trend = f"{cure_days} days ({cure_date})"
+
+    return trend
+
+
+# Trend bands, least to most severe - the first words of get_covid19_trend()'s label.  A falling
+# weekly average is RECOVERING, labelled with its "N days (date)" projection instead.
+g_trend_bands = ["RECOVERING", "CONTROLLED", "TRYING", "WARNING", "ACTIVE SPREAD", "DANGER ZONE", "UNCONTROLLED"]
+
+
+def get_covid19_trend_bands(case_count_new, wkly_avg):
+    # get_covid19_trend()'s band of every element, as g_trend_bands indices
+    import numpy as np
+    case_count_new = np.asarray(case_count_new, dtype=np.float64)
+    wkly_avg = np.asarray(wkly_avg, dtype=np.float64)
+    net_zero = case_count_new - wkly_avg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sick_percentage = np.where(net_zero != 0, wkly_avg / net_zero, (wkly_avg != 0).astype(np.float64))
+
+    # CONTROLLED, WARNING, ACTIVE SPREAD, DANGER ZONE, UNCONTROLLED by sick percentage
+    bands = np.array([1, 3, 4, 5, 6], dtype=np.int8)[
+        np.searchsorted([0.1, 0.25, 0.5, 0.9], sick_percentage, side='right')]
+    # a weekly average of at least today's new cases (a test anomaly) is banded by the average
+    anomaly = np.array([1, 2, 3, 4, 5, 6], dtype=np.int8)[
+        np.searchsorted([10, 50, 100, 500, 1000], wkly_avg, side='left')]
+    bands = np.where(wkly_avg >= case_count_new, anomaly, bands)
+    return np.where(wkly_avg > -1, bands, 0).astype(np.int8)
+
+
+# Rolling window metrics, per window N days:
+#   cases_avg, deaths_avg - new cases / deaths over the last N days, / N
+#   cases_growth          - new cases over the last N days vs the N days before, % change
+#   cases_doubling        - days for new cases to double at cases_growth; negative when halving
+# NYT counts are YTD - a running sum of new cases - so any window's new cases are one
+# subtraction, YTD(day) - YTD(day - N), whatever N is.
+g_rolling_metrics = ['cases_avg', 'deaths_avg', 'cases_growth', 'cases_doubling']
+
+
+def get_rolling_metric_names(windows):
+    # metric name of each (window, rolling metric), window major
+    return ['%s_%d' % (name, w) for w in windows for name in g_rolling_metrics]
+
+
+def get_window_counts(counts, w):
+    # new counts over the w days up to each day; YTD counts before day 0 are 0
+    import numpy as np
+    window = counts.astype(np.float64)
+    if w < counts.shape[1]:
+        window[:, w:] -= counts[:, :-w]
+    return window
+
+
+def get_rolling_metrics(cases, deaths, windows):
+    # {metric name: (geography x day)} of YTD cases / deaths carried forward over unreported days
+    import numpy as np
+    metrics = dict()
+    for w in windows:
+        cases_window = get_window_counts(cases, w)
+        cases_prior = np.zeros(cases_window.shape)
+        if w < cases.shape[1]:
+            cases_prior[:, w:] = cases_window[:, :-w]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(cases_prior > 0, cases_window / cases_prior, np.nan)
+            doubling = np.where((ratio > 0) & (ratio != 1), w * np.log(2) / np.log(ratio), np.nan)
+        metrics['cases_avg_%d' % (w)] = cases_window / w
+        metrics['deaths_avg_%d' % (w)] = get_window_counts(deaths, w) / w
+        metrics['cases_growth_%d' % (w)] = (ratio - 1) * 100
+        metrics['cases_doubling_%d' % (w)] = doubling
+    return metrics
+
+
+def get_covid19_rolling(location, windows):
+    # rolling metric arrays of any State/County, one entry per reported day, see get_rolling_metric_names()
+    import numpy as np
+    if location.covid19_series is not None:
+        return location.covid19_series.get_metrics(get_rolling_metric_names(windows))
+
+    days = get_covid19_days(location)
+    (cases, deaths, active) = get_covid19_counts(location)
+    if len(days) == 0:
+        return [np.zeros(0) for name in get_rolling_metric_names(windows)]
+    # carry YTD counts forward over unreported days, as Covid19Metrics.calc()
+    latest = np.searchsorted(days, np.arange(days[-1] + 1), side='right') - 1
+    has_latest = latest >= 0
+    latest = np.maximum(latest, 0)
+    metrics = get_rolling_metrics(cases[None, latest] * has_latest, deaths[None, latest] * has_latest, windows)
+    return [metrics[name][0, days] for name in get_rolling_metric_names(windows)]
+
+
+class Covid19Metrics:
+    def __init__(self, matrix, path=None, stored_rows=None):
+        # path        - see update(); calc() alone keeps metrics in memory
+        # stored_rows - True for rows of matrix kept in path; other rows hold partial, IngestFilter
+        #               dependent totals and are computed every run
+        import numpy as np
+        self.matrix = matrix
+        self.path = Path(path) if path is not None else None
+        self.stored_rows = np.array(stored_rows if stored_rows is not None else [], dtype=bool)
+
+        m = matrix
+        shape = (len(m.locations), m.n_days)
+        for name in g_covid19_metrics_float:
+            m.metrics[name] = np.zeros(shape, dtype=np.float64)
+        for name in g_covid19_metrics_int:
+            m.metrics[name] = np.zeros(shape, dtype=np.int32)
+        for name in get_rolling_metric_names(g_rolling_windows):
+            m.metrics[name] = np.zeros(shape, dtype=np.float64)
+        m.trend = np.zeros(len(m.locations), dtype=object)
+        m.trend[:] = ""
+        self.population = np.array([loc.get_population() for loc in m.locations], dtype=np.int64)
+
+    def get_params(self):
+        return {'version': g_covid19_metrics_version, 'case-days-duration': g_days,
+                'case-rolling-windows': g_rolling_windows,
+                'geography-per-county': g_per_county, 'geography-per-state': g_per_state}
+
+    def calc(self, rows=None, first_day=0):
+        # metrics of matrix rows, for days first_day onwards
+        import numpy as np
+        m = self.matrix
+        if rows is None:
+            rows = np.arange(len(m.locations))
+        if len(rows) == 0 or first_day >= m.n_days:
+            return
+        days = slice(first_day, None)
+        day_range = np.arange(first_day, m.n_days)
+        cases = m.cases[rows, days].astype(np.int64)
+        deaths = m.deaths[rows, days].astype(np.int64)
+
+        # per capita scale of each geography; no population, no per capita values
+        population = self.population[rows].astype(np.float64)
+        scale = np.array([g_per_state if m.locations[r].get_geography() == 'State' else g_per_county
+                          for r in rows], dtype=np.float64)
+        per_capita = np.divide(scale, population, out=np.zeros(len(rows)), where=population > 0)
+        m.metrics['death_per_capita'][rows, days] = deaths * per_capita[:, None]
+        m.metrics['cases_per_capita'][rows, days] = cases * per_capita[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m.metrics['cfr'][rows, days] = deaths / cases * 100
+
+        # new = today's YTD count - the prior reported day's YTD count (0 if none)
+        reported = m.reported[rows]
+        latest = np.maximum.accumulate(np.where(reported, np.arange(m.n_days), -1), axis=1)
+        prior = np.full((len(rows), len(day_range)), -1, dtype=np.int64)
+        if first_day > 0:
+            prior[:, 0] = latest[:, first_day-1]
+        prior[:, 1:] = latest[:, first_day:-1]
+        has_prior = prior >= 0
+        prior = np.maximum(prior, 0)
+        m.metrics['cases_new'][rows, days] = cases - np.take_along_axis(m.cases[rows], prior, axis=1) * has_prior
+        m.metrics['deaths_new'][rows, days] = deaths - np.take_along_axis(m.deaths[rows], prior, axis=1) * has_prior
+
+        # weekly average: active cases a week ago are 0 if unreported
+        week_ago = np.maximum(day_range - 7, 0)
+        active = m.active[rows]
+        active_week_ago = np.where((day_range >= 7) & reported[:, week_ago], active[:, week_ago], 0)
+        m.metrics['wkly_avg'][rows, days] = (active[:, days] - active_week_ago) / 7
+        m.metrics['trend_band'][rows, days] = get_covid19_trend_bands(m.metrics['cases_new'][rows, days],
+                                                                      m.metrics['wkly_avg'][rows, days])
+
+        # rolling windows reach back before first_day: YTD counts carried forward over every day
+        has_latest = latest >= 0
+        carried = np.maximum(latest, 0)
+        rolling = get_rolling_metrics(np.take_along_axis(m.cases[rows], carried, axis=1) * has_latest,
+                                      np.take_along_axis(m.deaths[rows], carried, axis=1) * has_latest,
+                                      g_rolling_windows)
+        for (name, values) in rolling.items():
+            m.metrics[name][rows, days] = values[:, days]
+
+        # trend of each geography's latest reported day
+        for (i, r) in enumerate(rows.tolist()):
+            day = int(latest[i, -1])
+            if day < 0:
+                m.trend[r] = ""
+                continue
+            m.trend[r] = get_covid19_trend(day, int(m.active[r, day]),
+                                           int(m.metrics['cases_new'][r, day]),
+                                           float(m.metrics['wkly_avg'][r, day]))
+
+    def load(self):
+        import numpy as np
+        if not self.path.exists():
+            return None
+        try:
+            with np.load(self.path, allow_pickle=False) as npz:
+                stored = {key: npz[key] for key in npz.files}
+            stored['meta'] = json.loads(str(stored['meta']))
+        except Exception as e:
+            dbg("covid19 metrics - unable to load %s: %s" % (self.path, e))
+            return None
+        if stored['meta'].get('params') != self.get_params():
+            dbg("covid19 metrics - settings changed, ignoring %s" % (self.path))
+            return None
+        return stored
+
+    def save(self, source, stored=None):
+        # stored - rows for other geographies, kept as long as they share source
+        import numpy as np
+        m = self.matrix
+        rows = np.flatnonzero(self.stored_rows)
+        data = {'fips': m.fips[rows], 'population': self.population[rows],
+                'trend': np.array(m.trend[rows].tolist(), dtype=str)}
+        for name in m.metrics:
+            data[name] = m.metrics[name][rows]
+
+        if stored is not None and stored['meta']['source'] == source and stored['cfr'].shape[1] == m.n_days:
+            keep = ~np.isin(stored['fips'], data['fips'])
+            for key in data:
+                data[key] = np.concatenate([data[key], stored[key][keep]])
+            order = np.argsort(data['fips'], kind='stable')
+            for key in data:
+                data[key] = data[key][order]
+
+        data['meta'] = np.array(json.dumps({'params': self.get_params(), 'source': source}))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp_path, self.path)
+
+    def update(self, store):
+        # compute or load metrics of every row, as little computation as possible
+        import numpy as np
+        m = self.matrix
+        source = store.meta
+        stored = self.load()
+
+        first_day = 0
+        if stored is not None:
+            if stored['meta']['source'] == source:
+                first_day = m.n_days
+            elif stored['meta']['source'] == store.prior_meta:
+                first_day = store.first_day
+            else:
+                stored = None
+        if stored is None or first_day == 0:
+            dbg("covid19 metrics - full %s" % (self.path.name))
+        elif first_day >= m.n_days:
+            dbg("covid19 metrics - %s up to date" % (self.path.name))
+        else:
+            dbg("covid19 metrics - %s from day %i" % (self.path.name, first_day))
+
+        cached = np.zeros(len(m.locations), dtype=bool)
+        if stored is not None and first_day > 0 and len(stored['fips']) > 0:
+            # current rows found in stored, same population
+            idx = np.minimum(np.searchsorted(stored['fips'], m.fips), len(stored['fips']) - 1)
+            found = self.stored_rows & (stored['fips'][idx] == m.fips)
+            found &= stored['population'][idx] == self.population
+            rows = np.flatnonzero(found)
+            n_days = min(first_day, m.n_days, stored['cfr'].shape[1])
+            for name in m.metrics:
+                m.metrics[name][rows, :n_days] = stored[name][idx[rows], :n_days]
+            m.trend[rows] = stored['trend'][idx[rows]]
+            self.calc(rows, n_days)
+            cached[rows] = True
+            dbg("covid19 metrics - %i of %i geographies stored" % (len(rows), len(m.locations)))
+        self.calc(np.flatnonzero(~cached))
+
+        if first_day < m.n_days or not cached[self.stored_rows].all():
+            self.save(source, stored)
+
 ################
 ## Spreadsheet ################################################################
 
 
-class XLSX:
+def import_openpyxl():
+    # openpyxl is the slowest import by far; runs generating no xlsx never load it
+    global openpyxl
+    global Workbook
+    global WriteOnlyCell
+    global get_column_letter
+    global LineChart
+    global Reference
+    global CellIsRule
+    import openpyxl
+    import openpyxl.styles
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+    from openpyxl.chart import LineChart, Reference
+    from openpyxl.formatting.rule import CellIsRule
+
+
+# Run-scoped memo of each location's numbers, so a location in several spreadsheets -- eg ND in
+# US, dakota_battle & ND -- is computed once.  Key: (location, benchmark, per capita scale, case
+# duration, active sweep days, rolling windows); value: {'series': see XLSX.get_location_series(),
+# 'bands': see XLSX.get_location_bands(), 'rolling': see XLSX.get_location_rolling(), 'summary':
+# see XLSX.get_location_summary()}.  Cleared whenever covid data is ingested, see
+# ingest_covid19_data(), and in --serve whenever a request's settings differ from the last one's,
+# see Covid19Service.gen_xlsx().
+g_location_memo = dict()
 
-    def init_data(self):
-        # data dictionaries have a key of YYYY-MM-DD and an integer value representing covid19 data.
-        self.death_per_capita = dict()
-        self.cfr = dict()
-        self.per_capita_cases = dict()
 
-        self.actual_cases_new = dict()  # Increase/decrease from prior day (daily delta)
-        self.death_cases_new = dict()  # increase/decrease from prior day (daily delta)
-
-        self.active_cases = dict()  # YTD
-        self.actual_cases = dict()  # YTD
-        self.death_cases = dict()  # YTD
+class XLSX:
 
-        # Must sequence/order of self.data_wb
-        self.data = [self.death_per_capita, self.cfr, self.per_capita_cases,
-                     self.actual_cases_new, self.death_cases_new,
-                     self.active_cases, self.actual_cases, self.death_cases]
+    def init_data(self):
+        # metric values & present masks, one entry per (location, day) - see gen_locations_data();
+        # each is scattered into its (day x location) table as its worksheet is written, get_table()
+        self.data = []
+        self.n_days = 0
+
+        # Active cases for each additional case duration - columnar ingest only, object ingest
+        # computes g_days alone, see ingest_covid19_data()
+        self.active_sweep_days = []
+        if g_ingest_engine == "columnar":
+            self.active_sweep_days = sorted(set(g_days_sweep) - set([g_days]))
+        self.metric_names = ['death_per_capita', 'cfr', 'cases_per_capita', 'cases_new', 'deaths_new']
+
+        # Rolling window metrics, see get_rolling_metrics()
+        self.rolling_windows = sorted(set(g_rolling_windows))
+        self.rolling_names = get_rolling_metric_names(self.rolling_windows)
 
         self.per_capita_by_geography = dict()
         self.per_capita_by_geography['State'] = g_per_state
@@ -877,12 +2634,20 @@ class XLSX:
             self.per_capita_by_geography['County'])
 
     def init_wb(self):
-        self.wb = Workbook()
+        # write only: rows stream to disk as they are appended, cells cannot be revisited
+        self.write_only = g_xlsx_write_only
+        self.wb = Workbook(write_only=self.write_only)
 
     def init_ws(self):
+        self.add_named_styles()
+
         # summary worksheet
-        self.cur_data_wb = self.wb.active
-        self.cur_data_wb.title = "today"
+        if self.write_only:
+            self.cur_data_wb = self.wb.create_sheet(title="today")
+        else:
+            self.cur_data_wb = self.wb.active
+            self.cur_data_wb.title = "today"
+        self.trend_wb = self.wb.create_sheet(title="trend")
 
         # todo - create an object representing data dictionary, workbook and chartname
         # data worksheets
@@ -907,6 +2672,18 @@ class XLSX:
                             "Daily Reported", "Daily Dead",
                             "Active", "Reported", "Dead"]
 
+        for d in self.active_sweep_days:
+            self.data_wb.append(self.wb.create_sheet(title="active %d days" % (d)))
+            self.chart_names.append("Active (%d Day)" % (d))
+
+        for w in self.rolling_windows:
+            self.data_wb.extend([self.wb.create_sheet(title="cases %d day avg" % (w)),
+                                 self.wb.create_sheet(title="dead %d day avg" % (w)),
+                                 self.wb.create_sheet(title="cases %d day growth" % (w)),
+                                 self.wb.create_sheet(title="cases %d day doubling" % (w))])
+            self.chart_names.extend(["Daily Reported (%d Day Avg)" % (w), "Daily Dead (%d Day Avg)" % (w),
+                                     "Reported Growth %% (%d Day)" % (w), "Reported Doubling Days (%d Day)" % (w)])
+
         self.changelog_wb = self.wb.create_sheet(title="changelog")
 
     def gen_header_row(self):
@@ -918,67 +2695,209 @@ class XLSX:
 
     def add_headers(self):
         self.gen_header_row()
-        for wb in self.data_wb:
+        for wb in self.data_wb + [self.trend_wb]:
             wb.append(self.hdr)
 
-    # Build an empty day for each geography in each data dictionary
-    def check_day(self, day):
-        for case_dict in self.data:
-            if day not in case_dict:
-                case_dict[day] = dict()
-                for n in self.loc_names:
-                    case_dict[day][n] = None  # 0
-
-    def gen_location_data(self, location):
-        # init
-        cur_case = 0
-        loc_name = location.get_name()
-        loc_per_capita = self.per_capita_by_geography[location.get_geography(
-        )]/location.get_population()
-        prior_day_case = None
-
-        # calculate covid19 case data for geography cases
-        for covid_data in location.covid19_cases:
-            covid_case = covid_data
-            if isinstance(covid_data, str):
-                covid_case = location.covid19_cases[covid_data]
-
-            if covid_case.case_count >= self.benchmark:
-                cur_case += 1
-                cur_day = "Day %03d" % (cur_case)
-
-                self.check_day(cur_day)
-
-                # value calcs
-                self.death_per_capita[cur_day][loc_name] = covid_case.death_count*loc_per_capita
-                self.cfr[cur_day][loc_name] = covid_case.death_count / \
-                    covid_case.case_count*100
-                if location.get_population() > 0:
-                    self.per_capita_cases[cur_day][loc_name] = covid_case.case_count*loc_per_capita
-                self.active_cases[cur_day][loc_name] = covid_case.active_count
-                self.actual_cases[cur_day][loc_name] = covid_case.case_count
-                self.death_cases[cur_day][loc_name] = covid_case.death_count
-
-                # new cases = todays YTD count - yesterday's YTD count
-                if prior_day_case is not None:
-                    self.actual_cases_new[cur_day][loc_name] = covid_case.case_count - \
-                        prior_day_case.case_count
-                    self.death_cases_new[cur_day][loc_name] = covid_case.death_count - \
-                        prior_day_case.death_count
-
-                prior_day_case = covid_case
+    def get_location_memo(self, loc):
+        # loc's g_location_memo entry for this spreadsheet's settings
+        key = (loc, self.benchmark, self.per_capita_by_geography[loc.get_geography()], g_days,
+               tuple(self.active_sweep_days), tuple(self.rolling_windows))
+        memo = g_location_memo.get(key)
+        if memo is None:
+            memo = g_location_memo[key] = dict()
+        return memo
+
+    def get_location_bands(self, location):
+        # (days, trend bands) of every reported day of the location, see get_covid19_trend_bands()
+        import numpy as np
+        memo = self.get_location_memo(location)
+        if 'bands' not in memo:
+            days = get_covid19_days(location)
+            if location.covid19_series is not None:
+                bands = location.covid19_series.get_metrics(['trend_band'])[0]
+            else:
+                # as get_location_summary() - new cases since the prior reported day, weekly average
+                # from active cases a week ago, 0 if unreported
+                (cases, deaths, active) = get_covid19_counts(location)
+                week_ago = np.minimum(np.searchsorted(days, days - 7), max(len(days) - 1, 0))
+                active_week_ago = np.where(days[week_ago] == days - 7, active[week_ago], 0)
+                bands = get_covid19_trend_bands(np.diff(cases, prepend=0), (active - active_week_ago) / 7)
+            memo['bands'] = (days, bands)
+        return memo['bands']
+
+    def get_location_rolling(self, location):
+        # rolling metric arrays of every reported day of the location, in self.rolling_names order
+        memo = self.get_location_memo(location)
+        if 'rolling' not in memo:
+            memo['rolling'] = get_covid19_rolling(location, self.rolling_windows)
+        return memo['rolling']
+
+    def get_location_series(self, location):
+        # (cases, deaths, active, trend bands, rolling, active sweep, metrics, prior) of the
+        # location's days at or over the benchmark; the last three, columnar ingest only, are None
+        # otherwise.  prior is True when the day before is the location's prior reported day.
+        import numpy as np
+        memo = self.get_location_memo(location)
+        if 'series' not in memo:
+            (loc_cases, loc_deaths, loc_active) = get_covid19_counts(location)
+            q = loc_cases >= self.benchmark
+            series = (loc_cases[q], loc_deaths[q], loc_active[q], self.get_location_bands(location)[1][q],
+                      [values[q] for values in self.get_location_rolling(location)],
+                      None, None, None)
+            if location.covid19_series is not None:
+                series = series[:5] + (
+                    [location.covid19_series.get_active_counts(d)[q] for d in self.active_sweep_days],
+                    [values[q] for values in location.covid19_series.get_metrics(self.metric_names)],
+                    np.append(False, q[:-1])[q])
+            memo['series'] = series
+        return memo['series']
 
     def gen_locations_data(self):
-        for loc in self.locations:
-            self.gen_location_data(loc)
+        # Day NNN alignment: each location starts at day 1 on the first reported day its case count
+        # reaches the benchmark. Every location's qualifying days are concatenated, then each metric is
+        # scattered into a (day x location) table in one pass.
+        import numpy as np
+        n_locs = len(self.locations)
+        loc_idx = [np.zeros(0, dtype=np.intp)]
+        cases = [np.zeros(0, dtype=np.int64)]
+        deaths = [np.zeros(0, dtype=np.int64)]
+        active = [np.zeros(0, dtype=np.int64)]
+        trend = [np.zeros(0, dtype=np.int8)]
+        rolling = [[np.zeros(0)] for name in self.rolling_names]
+        active_sweep = [[] for d in self.active_sweep_days]
+        active_sweep_idx = []
+        metrics = [[] for name in self.metric_names]  # columnar ingest, see Covid19Metrics
+        metrics_prior = []  # True when the prior entry is the location's prior reported day
+        for (idx, location) in enumerate(self.locations):
+            (loc_cases, loc_deaths, loc_active, loc_trend, loc_rolling, loc_sweep, loc_metrics, loc_prior) = \
+                self.get_location_series(location)
+            loc_idx.append(np.full(len(loc_cases), idx, dtype=np.intp))
+            cases.append(loc_cases)
+            deaths.append(loc_deaths)
+            active.append(loc_active)
+            trend.append(loc_trend)
+            for (values, loc_values) in zip(rolling, loc_rolling):
+                values.append(loc_values)
+            # active cases per additional case duration & derived metrics (columnar ingest only)
+            if loc_sweep is not None:
+                active_sweep_idx.append(loc_idx[-1])
+                for (active_sweep_cases, loc_values) in zip(active_sweep, loc_sweep):
+                    active_sweep_cases.append(loc_values)
+                for (values, loc_values) in zip(metrics, loc_metrics):
+                    values.append(loc_values)
+                metrics_prior.append(loc_prior)
+
+        loc_idx = np.concatenate(loc_idx).astype(np.intp)
+        cases = np.concatenate(cases).astype(np.int64)
+        deaths = np.concatenate(deaths).astype(np.int64)
+        active = np.concatenate(active).astype(np.int64)
+
+        # day within location: entries are grouped by location, in date order
+        n = len(loc_idx)
+        first = np.ones(n, dtype=bool)
+        first[1:] = loc_idx[1:] != loc_idx[:-1]
+        starts = np.flatnonzero(first)
+        day = np.arange(n) - np.repeat(starts, np.diff(np.append(starts, n)))
+        self.n_days = int(day.max()) + 1 if n else 0
+
+        # no population, no per capita values
+        population = np.array([loc.get_population() for loc in self.locations], dtype=np.float64)
+        has_population = population > 0
+        per_capita = has_population[loc_idx]
+        prior = ~first
+
+        if n_locs > 0 and len(metrics_prior) == n_locs:
+            # precomputed, see Covid19Metrics
+            (death_per_capita, cfr, cases_per_capita, cases_new, deaths_new) = [
+                np.concatenate(values) for values in metrics]
+            # new cases across days below the benchmark are relative to the prior qualifying day
+            gap = np.flatnonzero(prior & ~np.concatenate(metrics_prior))
+            cases_new[gap] = cases[gap] - cases[gap-1]
+            deaths_new[gap] = deaths[gap] - deaths[gap-1]
+        else:
+            # per capita scale of each location
+            scale = np.array([self.per_capita_by_geography[loc.get_geography()]
+                              for loc in self.locations], dtype=np.float64)
+            loc_per_capita = np.divide(scale, population, out=np.zeros(n_locs), where=has_population)[loc_idx]
+            death_per_capita = deaths * loc_per_capita
+            cases_per_capita = cases * loc_per_capita
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cfr = deaths / cases * 100
+
+            # new cases = todays YTD count - yesterday's YTD count
+            cases_new = cases - np.roll(cases, 1)
+            deaths_new = deaths - np.roll(deaths, 1)
+
+        self.day = day
+        self.loc_idx = loc_idx
+        self.trend = np.concatenate(trend)  # trend band of each (location, day), see add_trend_to_xlsx()
+
+        # Must sequence/order of self.data_wb
+        self.data = [(death_per_capita, per_capita), (cfr, cases > 0),
+                     (cases_per_capita, per_capita),
+                     (cases_new, prior), (deaths_new, prior),
+                     (active, None), (cases, None), (deaths, None)]
+
+        if len(active_sweep_idx):
+            sweep_idx = np.concatenate(active_sweep_idx)
+            sweep_present = np.zeros(n_locs, dtype=bool)
+            sweep_present[sweep_idx] = True
+            sweep_present = sweep_present[loc_idx]
+        else:
+            sweep_present = np.zeros(n, dtype=bool)
+        for active_sweep_cases in active_sweep:
+            values = np.zeros(n, dtype=np.int64)
+            if len(active_sweep_cases):
+                values[sweep_present] = np.concatenate(active_sweep_cases)
+            self.data.append((values, sweep_present))
+
+        # rolling window metrics; growth & doubling are undefined without new cases the window before
+        for values in rolling:
+            values = np.concatenate(values).astype(np.float64)
+            self.data.append((values, np.isfinite(values)))
+
+    def get_table(self, values, present=None):
+        # (day x location) table of one metric, and its present mask
+        import numpy as np
+        t = np.zeros((self.n_days, len(self.locations)), dtype=values.dtype)
+        p = np.zeros((self.n_days, len(self.locations)), dtype=bool)
+        if present is None:
+            t[self.day, self.loc_idx] = values
+            p[self.day, self.loc_idx] = True
+        else:
+            t[self.day[present], self.loc_idx[present]] = values[present]
+            p[self.day[present], self.loc_idx[present]] = True
+        return (t, p)
+
+    def get_chart_cols(self):
+        # [(min_col, max_col)] worksheet column runs charted - every location, or when there are more
+        # than g_xlsx_chart_series, those with the most cases, in worksheet order
+        import numpy as np
+        n_locs = len(self.locations)
+        if n_locs <= g_xlsx_chart_series:
+            return [(2, n_locs+1)] if n_locs > 0 else []
+
+        cases = np.zeros(n_locs, dtype=np.int64)
+        for (idx, loc) in enumerate(self.locations):
+            d = loc.get_current_covid19_case()
+            if d is not None:
+                cases[idx] = d.case_count
+        cols = np.sort(np.argsort(-cases, kind='stable')[:g_xlsx_chart_series]) + 2
+
+        runs = np.flatnonzero(np.diff(cols) != 1) + 1
+        return [(int(run[0]), int(run[-1])) for run in np.split(cols, runs) if len(run) > 0]
 
     def add_count_to_xlsx(self, ws, data, title):
-        for day in sorted(data):
-            r = [day]
-            for n in self.loc_names:
-                r.append(data[day][n])
+        (values, present) = self.get_table(*data)
+        for day in range(len(values)):
+            r = ["Day %03d" % (day + 1)]
+            for (v, p) in zip(values[day].tolist(), present[day].tolist()):
+                r.append(v if p else None)
             ws.append(r)
 
+        if len(self.chart_cols) == 0:
+            return
+
         # Build Chart
         chart = LineChart()
         chart.title = "%s Covid-19 Cases" % (title)
@@ -986,19 +2905,100 @@ class XLSX:
         chart.y_axis.title = "%s Count" % (title)
         chart.x_axis.title = "Days"
         cats = Reference(ws, min_col=1, min_row=1,
-                         max_col=1, max_row=len(data)+1)
-        data = Reference(ws, min_col=2, min_row=1,
-                         max_col=len(self.hdr), max_row=len(data)+1)
-        chart.add_data(data, titles_from_data=True)
+                         max_col=1, max_row=self.n_days+1)
+        for (min_col, max_col) in self.chart_cols:
+            data = Reference(ws, min_col=min_col, min_row=1,
+                             max_col=max_col, max_row=self.n_days+1)
+            chart.add_data(data, titles_from_data=True)
         chart.set_categories(cats)
         ws.add_chart(chart, "G2")
 
+    def add_trend_to_xlsx(self, ws):
+        # trend band names, uncharted
+        import numpy as np
+        (values, present) = self.get_table(self.trend)
+        bands = np.array(g_trend_bands, dtype=object)
+        for day in range(len(values)):
+            r = ["Day %03d" % (day + 1)]
+            r.extend(np.where(present[day], bands[values[day]], None).tolist())
+            ws.append(r)
+
     def add_counts_to_xlsx(self):
+        self.chart_cols = self.get_chart_cols()
         for idx in range(len(self.data)):
             self.add_count_to_xlsx(
                 self.data_wb[idx], self.data[idx], self.chart_names[idx])
+        self.add_trend_to_xlsx(self.trend_wb)
+
+    def get_location_summary(self, loc):
+        # loc's "today" worksheet row - its latest reported day
+        import numpy as np
+        memo = self.get_location_memo(loc)
+        if 'summary' in memo:
+            return memo['summary']
+
+        g = loc.get_geography()
+        p = loc.get_population()  # p (population)
+        per_capita_scale = self.per_capita_by_geography[g]
+        per_capita = round(p / per_capita_scale, 2)
+        per_capita_div = per_capita or p / per_capita_scale  # eg Kalawao County, HI - 86 people
+        d = loc.get_current_covid19_case()  # d (data)
+        if d is None:
+            print("Got None")
+            print(loc.name)
+            print(len(loc.covid19_cases))
+        prior_d = loc.get_prior_covid19_case()  # prior_d (prior_data)
+        if d.case_count != 0:
+            d_ratio = d.death_count/d.case_count
+        else:
+            if d.death_count == 0:
+                d_ratio = 0.0
+            else:
+                d_ratio = 1.0
 
-    def add_population_to_xlsx(self):
+        case_count_new = d.case_count - prior_d.case_count
+
+        if loc.covid19_series is not None:
+            # precomputed, see Covid19Metrics
+            (wkly_avg, trend) = loc.covid19_series.get_trend()
+        else:
+            # Calculate 7 day activity average
+            last_week = loc.get_specific_covid19_case(d.case_day - 7)
+            wkly_avg = (d.active_count - last_week.active_count)/7
+            trend = get_covid19_trend(d.case_day, d.active_count, case_count_new, wkly_avg)
+
+        memo['summary'] = [loc.get_name(),  # 0
+                           loc.get_parent_location(),  # 1
+                           get_day_str(d.case_day),  # 2
+                           d.death_count,  # 3
+                           d.death_count - prior_d.death_count,  # 4
+                           round(d.death_count/per_capita_div, 2),  # 5
+                           d_ratio,  # 6
+                           d.case_count,  # 7
+                           d.active_count,  # 8
+                           wkly_avg,  # 9 - 10/10/2020
+                           case_count_new,  # 10
+                           trend,  # 11 - 10/10/2020
+                           round(d.active_count/per_capita_div, 2),  # 12
+                           round(d.case_count/per_capita_div, 2),  # 13
+                           self.humanize(p),  # 14
+                           self.humanize(per_capita_scale),  # 15
+                           per_capita]  # 16
+
+        # rolling windows of the latest reported day: avg cases, avg dead, growth, doubling days
+        rolling = [float(values[-1]) for values in self.get_location_rolling(loc)]
+        for (name, value) in zip(self.rolling_names, rolling):
+            if not np.isfinite(value):
+                value = None
+            elif name.startswith('cases_growth'):
+                value = round(value / 100, 4)
+            else:
+                value = round(value, 2)
+            memo['summary'].append(value)
+        return memo['summary']
+
+    def gen_summary_data(self):
+        # "today" worksheet header & rows - one per location, its latest reported day
         col_num = Enum(
             'COL_NUM', ['NAME',
                         'REGION',
@@ -1017,27 +3017,32 @@ class XLSX:
                         'GEO_PER',
                         'PER_SCALE'])
 
-        self.cur_data_wb.append(['Name',                                            # 0
-                                 'Containing Region',                               # 1
-                                 'Case Date',                                       # 2
-                                 'Dead',                                            # 3
-                                 'New Dead',                                        # 4
-                                 'Dead Per %s' % (
-                                     self.per_capita_str),                          # 5
-                                 'Case Fatality Rate',                              # 6
-                                 'Cases',                                           # 7
-                                 'Active Cases',                                    # 8
-                                 'Daily Avg',                                       # 9 - 10/10/2020
-                                 'New Cases',                                       # 10
-                                 'Trend',                                           # 11 - 10/10/2020
-                                 'Active Per %s' % (
-                                     self.per_capita_str),                          # 12
-                                 'Cases Per %s' % (
-                                     self.per_capita_str),                          # 13
-                                 'Population',                                      # 14
-                                 'Geography Per %s Scale' % (
-                                     self.per_capita_str),                          # 15
-                                 'Per %s' % (self.per_capita_str)])                 # 16
+        hdr = (['Name',                                            # 0
+                'Containing Region',                               # 1
+                'Case Date',                                       # 2
+                'Dead',                                            # 3
+                'New Dead',                                        # 4
+                'Dead Per %s' % (
+                    self.per_capita_str),                          # 5
+                'Case Fatality Rate',                              # 6
+                'Cases',                                           # 7
+                'Active Cases',                                    # 8
+                'Daily Avg',                                       # 9 - 10/10/2020
+                'New Cases',                                       # 10
+                'Trend',                                           # 11 - 10/10/2020
+                'Active Per %s' % (
+                    self.per_capita_str),                          # 12
+                'Cases Per %s' % (
+                    self.per_capita_str),                          # 13
+                'Population',                                      # 14
+                'Geography Per %s Scale' % (
+                    self.per_capita_str),                          # 15
+                'Per %s' % (self.per_capita_str)])                 # 16
+        # rolling window columns, 4 per window
+        rolling_col_nums = list(range(len(hdr) + 1, len(hdr) + 1 + len(self.rolling_names)))
+        for w in self.rolling_windows:
+            hdr.extend(['%d Day Avg Cases' % (w), '%d Day Avg Dead' % (w),
+                        '%d Day Growth' % (w), '%d Day Doubling Days' % (w)])
 
         # To do - automatically enumerate below
         # Manually update below column 'constants' after updating above
@@ -1057,137 +3062,41 @@ class XLSX:
                                col_num.CASES_PER.value)
         self.scale_cols = (COL_NEW_DEAD_CHAR,
                            COL_CASES_CHAR)
+        self.comma_col_nums += tuple(rolling_col_nums[0::4] + rolling_col_nums[1::4])
+        self.growth_col_nums = tuple(rolling_col_nums[2::4])
 
-        cell_data = []
-        for loc in self.locations:
-            # loc=self.locations[loc_name]
-            g = loc.get_geography()
-            p = loc.get_population()  # p (population)
-            per_capita_scale = self.per_capita_by_geography[g]
-            per_capita = round(p / per_capita_scale, 2)
-            d = loc.get_current_covid19_case()  # d (data)
-            if d is None:
-                print("Got None")
-                print(loc.name)
-                print(len(loc.covid19_cases))
-            prior_d = loc.get_prior_covid19_case()  # prior_d (prior_data)
-            if d.case_count != 0:
-                d_ratio = d.death_count/d.case_count
-            else:
-                if d.death_count == 0:
-                    d_ratio = 0.0
-                else:
-                    d_ratio = 1.0
-
-            # Get last week's date
-            case_date_obj_cur = datetime.strptime(d.case_date, g_date_fmt)
-            case_date_obj_last_week = case_date_obj_cur - timedelta(days=7)
-            case_date_last_week = case_date_obj_last_week.strftime(g_date_fmt)
-
-            case_count_new = d.case_count - prior_d.case_count
-
-            # Calculate 7 day activity average
-            last_week = loc.get_specific_covid19_case(case_date_last_week)
-            wkly_avg = (d.active_count - last_week.active_count)/7
-
-            # Derived measures
-            net_zero = case_count_new - wkly_avg
-            if net_zero != 0:
-                sick_percentage = wkly_avg / net_zero
-            elif wkly_avg != 0:
-                # 100 new cases, 100 wkly avg: 100% sick
-                sick_percentage = 1.0
-            else:
-                # 0 new cases, 0 wkly avg: 0% sick.
-                sick_percentage = 0.0
-            sick_ratio = int(sick_percentage)
-
-            # Identify trend based on weekly avg
-            trend = ""
-            if wkly_avg > -1:  # a positive avg means more infections! Label/
-                if sick_percentage >= 0.9:
-                    trend = "UNCONTROLLED"
-                elif sick_percentage >= 0.50:
-                    trend = "DANGER ZONE"
-                elif sick_percentage >= 0.25:
-                    trend = "ACTIVE SPREAD"
-                elif sick_percentage >= 0.1:
-                    trend = "WARNING"
-                else:
-                    trend = "CONTROLLED"
-
-                # if we have a daily avg of 200, and a new case count, then today is a test anamoly.
-                if wkly_avg >= case_count_new:
-                    if wkly_avg > 1000:
-                        trend = "UNCONTROLLED"
-                    elif wkly_avg > 500:
-                        trend = "DANGER ZONE"
-                    elif wkly_avg > 100:
-                        trend = "ACTIVE SPREAD"
-                    elif wkly_avg > 50:
-                        trend = "WARNING"
-                    elif wkly_avg > 10:
-                        trend = "TRYING"
-                    else:
-                        trend = "CONTROLLED"
-
-                # If case_count = 100, and 25 people are daily avg, then 75 people who got sick replace people just getting healthy.
-                # this 75 is the "net_zero" -- the virus is not going up nor down, but staying the same.
-
-                trend_summary = ""
-                if net_zero > 0:
-                    # if case_count = 100, daily_avg = 50:
-                    #   50 people got better
-                    #   50 people got sick
-                    #   50 more people got sick
-                    #  then sick to healthy ratio is 1:1
-                    # if case_count = 100, daily_avg = 75, then:
-                    #   25 people got better
-                    #   25 people got sick
-                    #   75 more people got sick
-                    #  for each net_zero, 3 more people got sick
-
-                    if sick_ratio >= 1:
-                        sick_ratio = sick_ratio+1
-                        trend_summary = f"{sick_ratio}:1 growth"
-                    else:
-                        trend_summary = "+{0:.0%} growth".format(
-                            sick_percentage)
-                else:
-                    trend_summary = "n/a"
-
-                trend = f"{trend} [{trend_summary}]"
+        cell_data = [self.get_location_summary(loc) for loc in self.locations]
+        cell_data.sort(key=lambda x: x[self.sorting_col_num], reverse=True)
+        return (hdr, cell_data)
 
+    def add_population_to_xlsx(self):
+        (hdr, cell_data) = self.gen_summary_data()
+
+        ws = self.cur_data_wb
+        self.size_wb_cols(ws, [hdr] + cell_data)
+
+        # styled columns refer to a named style; every other cell is a plain value
+        col_styles = self.get_col_styles()
+        ws.append(hdr)
+        for (row_idx, r) in enumerate(cell_data, 2):
+            if self.write_only:
+                cells = list(r)
+                for (col_num, style) in col_styles.items():
+                    cells[col_num-1] = WriteOnlyCell(ws, value=r[col_num-1])
+                    cells[col_num-1].style = style
+                ws.append(cells)
             else:
-                cure_days = int(d.active_count/abs(wkly_avg))
-                cure_date = (case_date_obj_cur +
-                             timedelta(days=cure_days)).strftime(g_date_fmt)
-                trend = f"{cure_days} days ({cure_date})"
-
-            cell_data.append([loc.get_name(),  # 0
-                              loc.get_parent_location(),  # 1
-                              d.case_date,  # 2
-                              d.death_count,  # 3
-                              d.death_count - prior_d.death_count,  # 4
-                              round(d.death_count/per_capita, 2),  # 5
-                              d_ratio,  # 6
-                              d.case_count,  # 7
-                              d.active_count,  # 8
-                              wkly_avg,  # 9 - 10/10/2020
-                              case_count_new,  # 10
-                              trend,  # 11 - 10/10/2020
-                              round(d.active_count/per_capita, 2),  # 12
-                              round(d.case_count/per_capita, 2),  # 13
-                              self.humanize(p),  # 14
-                              self.humanize(per_capita_scale),  # 15
-                              per_capita])  # 16
+                ws.append(r)
+                for (col_num, style) in col_styles.items():
+                    ws.cell(row_idx, col_num).style = style
 
-        cell_data.sort(key=lambda x: x[self.sorting_col_num], reverse=True)
-        for data in cell_data:
-            self.cur_data_wb.append(data)
+        n_rows = len(cell_data) + 1
+        for col_num in self.neg_col_nums:
+            col_letter = get_column_letter(col_num)
+            for rule in self.get_daily_avg_rules():
+                ws.conditional_formatting.add("%s2:%s%d" % (col_letter, col_letter, n_rows), rule)
 
-        self.autosize_wb_cols(self.cur_data_wb)
-        self.filter_wb_cols(self.cur_data_wb)
+        ws.auto_filter.ref = "A1:%s%d" % (get_column_letter(len(hdr)), n_rows)
 
     def humanize(self, n):
         thousands = 1000
@@ -1204,63 +3113,61 @@ class XLSX:
 
         return "%s%s" % (val.rstrip('0').rstrip('.'), units)
 
-    def autosize_wb_cols(self, wb):
-        fills = [openpyxl.styles.PatternFill("solid", "548235"),   # -100 or better
-                 openpyxl.styles.PatternFill("solid", "A9D08E"),   # -40...-99
-                 openpyxl.styles.PatternFill("solid", "C6E0B4"),   # -5...-39
-                 openpyxl.styles.PatternFill("solid", "FFD966"),   # 4...-5
-                 openpyxl.styles.PatternFill("solid", "FFCCCC"),   #
-                 openpyxl.styles.PatternFill("solid", "FF7C80"),   #
-                 openpyxl.styles.PatternFill("solid", "FF0000")
-                 ]
-
-        for column_cells in wb.columns:
-            max_len = 0
-            col_letter = column_cells[0].column_letter
-
-            for cell in column_cells:
-                cur_len = len(str(cell.value))
-                if cur_len > max_len:
-                    max_len = cur_len
-
-                # Cell Styling
-                # number_format=https://openpyxl.readthedocs.io/en/stable/_modules/openpyxl/styles/numbers.html
-                cur_col = cell.column
-                if cur_col in self.comma_col_nums:
-                    cell.style = 'Comma [0]'
-                elif cur_col in self.neg_col_nums:
-                    cell.number_format = '#,##0'
-                    # Determine bg color
-                    try:
-                        val = int(cell.value)
-                        if val < -100:
-                            cell.fill = fills[0]
-                        elif val < -40:
-                            cell.fill = fills[1]
-                        elif val < - 5:
-                            cell.fill = fills[2]
-                        elif val < 5:
-                            cell.fill = fills[3]
-                        elif val < 40:
-                            cell.fill = fills[4]
-                        elif val < 100:
-                            cell.fill = fills[5]
-                        else:
-                            cell.fill = fills[6]
-                    except:
-                        pass  # ignore
-
-                elif cur_col == self.percent_col_num:
-                    cell.number_format = '0.00%'
-
-            # Need to account for columns with commas
-            scale_factor = 1
-            if col_letter in self.scale_cols:
-                scale_factor = 1.4
-            wb.column_dimensions[col_letter].width = (max_len+2)*scale_factor
-
-    def filter_wb_cols(self, wb):
-        wb.auto_filter.ref = wb.dimensions
+    def get_fills(self):
+        # conditional format fills are drawn with bgColor, cell fills with fgColor - set both
+        return [openpyxl.styles.PatternFill("solid", "548235", "548235"),   # -100 or better
+                openpyxl.styles.PatternFill("solid", "A9D08E", "A9D08E"),   # -40...-99
+                openpyxl.styles.PatternFill("solid", "C6E0B4", "C6E0B4"),   # -5...-39
+                openpyxl.styles.PatternFill("solid", "FFD966", "FFD966"),   # 4...-5
+                openpyxl.styles.PatternFill("solid", "FFCCCC", "FFCCCC"),   #
+                openpyxl.styles.PatternFill("solid", "FF7C80", "FF7C80"),   #
+                openpyxl.styles.PatternFill("solid", "FF0000", "FF0000")
+                ]
+
+    def get_daily_avg_rules(self):
+        # Daily Avg colour bands, first match wins.  Bands were first drawn from int(Daily Avg),
+        # which truncates toward zero (-100.5 => -100), so negative edges are one lower.
+        bands = [('lessThanOrEqual', -101),
+                 ('lessThanOrEqual', -41),
+                 ('lessThanOrEqual', -6),
+                 ('lessThan', 5),
+                 ('lessThan', 40),
+                 ('lessThan', 100),
+                 ('greaterThanOrEqual', 100)]
+        return [CellIsRule(operator=operator, formula=[str(value)], fill=fill, stopIfTrue=True)
+                for ((operator, value), fill) in zip(bands, self.get_fills())]
+
+    def add_named_styles(self):
+        # summary number formats, registered once per workbook; 'Comma [0]' is an Excel built in
+        # number_format=https://openpyxl.readthedocs.io/en/stable/_modules/openpyxl/styles/numbers.html
+        self.wb.add_named_style(openpyxl.styles.NamedStyle(name='Daily Avg', number_format='#,##0'))
+        self.wb.add_named_style(openpyxl.styles.NamedStyle(name='Case Fatality Rate', number_format='0.00%'))
+        self.wb.add_named_style(openpyxl.styles.NamedStyle(name='Growth', number_format='0.0%'))
+
+    def get_col_styles(self):
+        # summary column number => named style
+        col_styles = dict()
+        for col_num in self.comma_col_nums:
+            col_styles[col_num] = 'Comma [0]'
+        for col_num in self.neg_col_nums:
+            col_styles[col_num] = 'Daily Avg'
+        col_styles[self.percent_col_num] = 'Case Fatality Rate'
+        for col_num in self.growth_col_nums:
+            col_styles[col_num] = 'Growth'
+        return col_styles
+
+    def get_scale_factor(self, col_letter):
+        # Need to account for columns with commas
+        if col_letter in self.scale_cols:
+            return 1.4
+        return 1
+
+    def size_wb_cols(self, wb, rows):
+        # widths from the values about to be written
+        for col_idx in range(len(rows[0])):
+            max_len = max(len(str(r[col_idx])) for r in rows)
+            col_letter = get_column_letter(col_idx+1)
+            wb.column_dimensions[col_letter].width = (max_len+2)*self.get_scale_factor(col_letter)
 
     def add_change(self, date, desc):
         self.changelog_wb.append([date, desc])
@@ -1314,29 +3221,386 @@ class XLSX:
         self.add_change(
             '2020-03-29', 'Initial cut with simple/static geography set; day "0" is 10 cases. Assume unreported rate of 85%.')
 
-    def __init__(self, locations, benchmark=g_case_benchmark, filename="data"):
+    def __init__(self, locations, benchmark=None, filename="data"):
+        import_openpyxl()
         self.locations = locations
+        if benchmark is None:
+            benchmark = g_case_benchmark  # settings are loaded after this module is defined
         self.benchmark = benchmark
 
-        self.init_data()
+        with ProfileStage("XLSX %s build" % (filename)):
+            self.init_data()
+
+            self.init_wb()
+            self.init_ws()
+            self.add_headers()
+
+            self.gen_locations_data()
+            self.add_counts_to_xlsx()
+
+            self.add_population_to_xlsx()
+            self.add_changelog_to_xlsx()
+
+        self.wb_file = get_xlsx_filename(filename)
+
+        with ProfileStage("XLSX %s save" % (filename)):
+            self.wb.save(self.wb_file)
+
 
-        self.init_wb()
-        self.init_ws()
-        self.add_headers()
+class USCountiesXLSX(XLSX):
+    # "us-counties": every county, ~3,100 location columns per data worksheet.  Rows are always
+    # streamed (write-only), so memory does not grow with the workbook; charts are capped by
+    # g_xlsx_chart_series.  County names repeat across states, so columns are "County, State".
 
-        self.gen_locations_data()
-        self.add_counts_to_xlsx()
+    def init_wb(self):
+        self.write_only = True
+        self.wb = Workbook(write_only=True)
+
+    def gen_header_row(self):
+        self.hdr = ["Day"]
+        self.loc_names = []
+        for loc in self.locations:
+            self.hdr.append(loc.get_location())
+            self.loc_names.append(loc.get_location())
+
+
+def get_output_filename(dir_path, f):
+    # spreadsheet names come from configuration - posted ones too, see Covid19Service; never
+    # write outside dir_path
+    dir_path = dir_path.resolve()
+    fn = (dir_path / f).resolve()
+    if fn.parent != dir_path:
+        raise ValueError("%s is not a file in %s" % (f, dir_path))
+    return str(fn)
+
+
+def get_xlsx_filename(filename):
+    # xslx filename handling
+    xlsx_f = "covid19_%s_%s_data.xlsx" % (
+        date.today().strftime("%Y_%m_%d"), filename)
+    return get_output_filename(g_xlsx_path, xlsx_f)
+
+#######################
+## Unchanged xlsx reuse #######################################################
+
+# An xlsx file is rebuilt only when its fingerprint changes.  The fingerprint covers:
+#   * NYT data revision - git commit, us-counties.csv size & mtime
+#   * census geography / population sources
+#   * settings affecting spreadsheet content
+#   * this script
+#   * the spreadsheet's name & locations
+# Fingerprints are kept in g_xlsx_manifest_path along with each file's size & mtime, so an
+# edited or deleted xlsx file is rebuilt too.
 
-        self.add_population_to_xlsx()
-        self.add_changelog_to_xlsx()
+g_xlsx_manifest_path = g_cache_path / "xlsx-manifest.json"
 
-        # xslx filename handling
-        xlsx_f = "covid19_%s_%s_data.xlsx" % (
-            date.today().strftime("%Y_%m_%d"), filename)
-        xlsx_fn = g_xlsx_path / xlsx_f
-        self.wb_file = str(xlsx_fn.resolve())
 
-        self.wb.save(self.wb_file)
+def get_data_revision():
+    csv_path = g_covid19_data_path / "us-counties.csv"
+    st = os.stat(csv_path)
+    try:
+        commit = get_git_head(g_covid19_data_path)
+    except Exception:
+        commit = None
+    return {'commit': commit, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def get_run_fingerprint():
+    # inputs shared by every xlsx file of this run
+    with open(__file__, 'rb') as f:
+        code = hashlib.sha1(f.read()).hexdigest()
+    settings = {'case-min-benchmark': g_case_benchmark,
+                'case-days-duration': g_days,
+                'case-days-duration-sweep': g_days_sweep,
+                'case-rolling-windows': g_rolling_windows,
+                'geography-per-county': g_per_county,
+                'geography-per-state': g_per_state,
+                'ingest-engine': g_ingest_engine,
+                'xlsx-write-only': g_xlsx_write_only,
+                'xlsx-chart-series': g_xlsx_chart_series}
+    return json.dumps({'data': get_data_revision(), 'geography': get_geography_sources(),
+                       'settings': settings, 'code': code}, sort_keys=True)
+
+
+def get_xlsx_fingerprint(run_fingerprint, locations, filename):
+    h = hashlib.sha256(run_fingerprint.encode())
+    h.update(json.dumps([filename] + [[loc.get_geography(), loc.get_fips(), loc.get_name(), loc.get_population()]
+                                      for loc in locations]).encode())
+    return h.hexdigest()
+
+
+def load_xlsx_manifest():
+    try:
+        with open(g_xlsx_manifest_path) as f:
+            return json.load(f)
+    except Exception:
+        return dict()
+
+
+def save_xlsx_manifest(manifest):
+    # forget files no longer on disk
+    manifest = {wb_file: m for (wb_file, m) in manifest.items() if os.path.exists(wb_file)}
+    g_xlsx_manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(g_xlsx_manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def set_xlsx_manifest(manifest, wb_file, fingerprint):
+    st = os.stat(wb_file)
+    manifest[wb_file] = {'fingerprint': fingerprint, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def is_xlsx_unchanged(manifest, wb_file, fingerprint):
+    m = manifest.get(wb_file)
+    if m is None or m['fingerprint'] != fingerprint or not os.path.exists(wb_file):
+        return False
+    st = os.stat(wb_file)
+    return (st.st_size, st.st_mtime_ns) == (m['size'], m['mtime_ns'])
+
+###########################
+## Parallel xlsx generation ###################################################
+
+# Each XLSX is independent, and openpyxl is CPU bound - so with --jobs N, workbooks are
+# generated by a pool of N processes.
+#
+# The pool is forked *after* covid data is loaded: workers inherit States / Counties and the
+# covid19 matrices as-is.  Only a job index goes to a worker, and only a filename (plus any
+# ProfileStage records) comes back.
+#
+# fork is unavailable on Windows; there, xlsx files are generated one at a time.
+
+g_xlsx_jobs = []  # (locations, filename, XLSX class) - set just before the pool forks
+
+
+class XLSXFile:
+    # xlsx generated by a worker process; quacks like XLSX for send_email()
+    def __init__(self, wb_file):
+        self.wb_file = wb_file
+
+
+def gen_xlsx_job(job_idx):
+    (locations, filename, xlsx_class) = g_xlsx_jobs[job_idx]
+    trace_idx = len(g_trace)
+    wb_file = xlsx_class(locations, filename=filename).wb_file
+    return (wb_file, g_trace[trace_idx:])
+
+
+def gen_xlsx_files(xlsx_jobs, jobs=1):
+    global g_xlsx_jobs
+
+    # unchanged xlsx files are reused as-is
+    xlsx_files = [None] * len(xlsx_jobs)
+    fingerprints = dict()
+    manifest = dict()
+    if g_xlsx_reuse:
+        manifest = load_xlsx_manifest()
+        run_fingerprint = get_run_fingerprint()
+        for (job_idx, (locations, filename, xlsx_class)) in enumerate(xlsx_jobs):
+            wb_file = get_xlsx_filename(filename)
+            fingerprints[job_idx] = get_xlsx_fingerprint(run_fingerprint, locations, filename)
+            if is_xlsx_unchanged(manifest, wb_file, fingerprints[job_idx]):
+                xlsx_files[job_idx] = XLSXFile(wb_file)
+        print(" (%i of %i unchanged)" % (len(xlsx_jobs) - xlsx_files.count(None), len(xlsx_jobs)),
+              end='', flush=True)
+    job_idxs = [job_idx for (job_idx, xlsx_file) in enumerate(xlsx_files) if xlsx_file is None]
+
+    jobs = min(jobs, len(job_idxs))
+    if jobs > 1:
+        import multiprocessing
+        if "fork" not in multiprocessing.get_all_start_methods():
+            jobs = 1
+
+    if jobs <= 1:
+        for job_idx in job_idxs:
+            (locations, filename, xlsx_class) = xlsx_jobs[job_idx]
+            xlsx_files[job_idx] = xlsx_class(locations, filename=filename)
+    else:
+        import_openpyxl()  # once, inherited by every worker
+        g_xlsx_jobs = xlsx_jobs
+        try:
+            with multiprocessing.get_context("fork").Pool(jobs) as pool:
+                results = pool.map(gen_xlsx_job, job_idxs, chunksize=1)
+        finally:
+            g_xlsx_jobs = []
+
+        for (job_idx, (wb_file, trace)) in zip(job_idxs, results):
+            g_trace.extend(trace)
+            xlsx_files[job_idx] = XLSXFile(wb_file)
+
+    if g_xlsx_reuse:
+        for job_idx in job_idxs:
+            set_xlsx_manifest(manifest, xlsx_files[job_idx].wb_file, fingerprints[job_idx])
+        save_xlsx_manifest(manifest)
+
+    return xlsx_files
+
+
+#################
+## Data export ################################################################
+
+# The numbers an XLSX holds, without the workbook: for each spreadsheet & export format,
+#   <name>_today  - the "today" worksheet, one row per location
+#   <name>_series - every day aligned series, long format: one row per (location, Day NNN), with
+#                   a column per series; empty / null where the worksheet cell is empty
+#   <name>_trend  - trend band changes: one row per location & reported day whose band differs from
+#                   the prior reported day's, its first reported day included
+# Charts, styles and openpyxl are skipped entirely.  parquet & arrow (IPC file) require pyarrow.
+
+
+class XLSXExport(XLSX):
+    # XLSX's data preparation, written by g_export_writers rather than to a workbook
+
+    def __init__(self, locations, benchmark=None, filename="data", formats=("csv",)):
+        self.locations = locations
+        if benchmark is None:
+            benchmark = g_case_benchmark
+        self.benchmark = benchmark
+        self.files = []
+
+        with ProfileStage("Export %s" % (filename)):
+            self.init_data()
+            self.gen_locations_data()
+            self.series_names = self.metric_names + ['active', 'cases', 'deaths'] + \
+                ['active_%d_days' % (d) for d in self.active_sweep_days] + self.rolling_names
+            (self.summary_hdr, self.summary_data) = self.gen_summary_data()
+
+            for export_format in formats:
+                self.files.extend(g_export_writers[export_format](self, filename))
+
+    def get_location_columns(self, loc_idx):
+        # name, region & fips columns of rows belonging to locations loc_idx
+        import numpy as np
+        return [('name', np.array([loc.get_name() for loc in self.locations], dtype=object)[loc_idx], None),
+                ('region', np.array([loc.get_parent_location() for loc in self.locations],
+                                    dtype=object)[loc_idx], None),
+                ('fips', np.array([loc.get_fips() for loc in self.locations], dtype=np.int64)[loc_idx], None)]
+
+    def get_series_columns(self):
+        # [(column name, values, present or None)] of the long format series table
+        import numpy as np
+        columns = self.get_location_columns(self.loc_idx) + [('day', self.day + 1, None)]
+        for (name, (values, present)) in zip(self.series_names, self.data):
+            columns.append((name, values, present))
+        columns.append(('trend', np.array(g_trend_bands, dtype=object)[self.trend], None))
+        return columns
+
+    def get_trend_columns(self):
+        # [(column name, values, present or None)] of the trend band changes table
+        import numpy as np
+        loc_idx = [np.zeros(0, dtype=np.intp)]
+        days = [np.zeros(0, dtype=np.int64)]
+        bands = [np.zeros(0, dtype=np.int8)]
+        for (idx, location) in enumerate(self.locations):
+            (loc_days, loc_bands) = self.get_location_bands(location)
+            loc_idx.append(np.full(len(loc_days), idx, dtype=np.intp))
+            days.append(loc_days)
+            bands.append(loc_bands)
+        loc_idx = np.concatenate(loc_idx)
+        days = np.concatenate(days).astype(np.int64)
+        bands = np.concatenate(bands)
+
+        first = np.ones(len(loc_idx), dtype=bool)
+        first[1:] = loc_idx[1:] != loc_idx[:-1]
+        prior = np.roll(bands, 1)
+        changed = first | (bands != prior)
+
+        band_names = np.array(g_trend_bands, dtype=object)
+        case_dates = (np.datetime64(g_day_epoch) + days[changed]).astype(str).astype(object)
+        return self.get_location_columns(loc_idx[changed]) + [
+            ('date', case_dates, None),
+            ('trend', band_names[bands[changed]], None),
+            ('prior_trend', band_names[prior[changed]], ~first[changed])]
+
+    def get_column_tables(self):
+        # [(table name, columns)] written column by column
+        return [("series", self.get_series_columns()), ("trend", self.get_trend_columns())]
+
+
+def get_export_filename(filename, table, ext):
+    export_f = "covid19_%s_%s_%s.%s" % (
+        date.today().strftime("%Y_%m_%d"), filename, table, ext)
+    g_export_path.mkdir(parents=True, exist_ok=True)
+    return get_output_filename(g_export_path, export_f)
+
+
+def write_csv_export(export, filename):
+    today_file = get_export_filename(filename, "today", "csv")
+    with open(today_file, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(export.summary_hdr)
+        w.writerows(export.summary_data)
+
+    files = [today_file]
+    for (table_name, columns) in export.get_column_tables():
+        # columns as lists; None is written as an empty field
+        values = []
+        for (name, v, present) in columns:
+            v = v.tolist()
+            if present is not None:
+                v = [x if p else None for (x, p) in zip(v, present.tolist())]
+            values.append(v)
+
+        files.append(get_export_filename(filename, table_name, "csv"))
+        with open(files[-1], 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow([name for (name, v, present) in columns])
+            w.writerows(zip(*values))
+    return files
+
+
+def get_arrow_tables(export):
+    # [(table name, pyarrow Table)] - today, then export.get_column_tables()
+    import pyarrow as pa
+
+    tables = [("today", pa.table(dict([(name, [r[col] for r in export.summary_data])
+                                       for (col, name) in enumerate(export.summary_hdr)])))]
+    for (table_name, columns) in export.get_column_tables():
+        tables.append((table_name, pa.table(dict([(name, pa.array(v, mask=None if present is None else ~present))
+                                                  for (name, v, present) in columns]))))
+    return tables
+
+
+def write_parquet_export(export, filename):
+    tables = get_arrow_tables(export)
+    import pyarrow.parquet as pq
+
+    files = []
+    for (table_name, table) in tables:
+        files.append(get_export_filename(filename, table_name, "parquet"))
+        pq.write_table(table, files[-1])
+    return files
+
+
+def write_arrow_export(export, filename):
+    tables = get_arrow_tables(export)
+    import pyarrow as pa
+
+    files = []
+    for (table_name, table) in tables:
+        files.append(get_export_filename(filename, table_name, "arrow"))
+        with pa.OSFile(files[-1], 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    return files
+
+
+g_export_writers = {"csv": write_csv_export, "parquet": write_parquet_export, "arrow": write_arrow_export}
+g_export_pyarrow = ["parquet", "arrow"]  # formats requiring pyarrow
+
+
+def gen_export_files(xlsx_jobs):
+    # every spreadsheet's data in each configured non-xlsx format; [filenames]
+    formats = [f for f in g_export_formats if f in g_export_writers]
+    if importlib.util.find_spec("pyarrow") is None and len(set(formats) & set(g_export_pyarrow)) > 0:
+        print(" -- %s export requires pyarrow, skipped" %
+              (" / ".join([f for f in formats if f in g_export_pyarrow])), end='')
+        formats = [f for f in formats if f not in g_export_pyarrow]
+
+    files = []
+    for (locations, filename, xlsx_class) in xlsx_jobs:
+        files.extend(XLSXExport(locations, filename=filename, formats=formats).files)
+    print(" (%i files)" % (len(files)), end='', flush=True)
+    return files
 
 
 def get_county_id(s, c, str):
@@ -1345,10 +3609,17 @@ def get_county_id(s, c, str):
     state_abbr = csv[1].strip()
     state_fips = s.states_by_name[g_state_name[state_abbr]].state_fips
     #print("%s (%i) %s" % (state_abbr, state_fips, county))
-    return c.counties_for_pop_est[state_fips][county]
+    return c.get_for_pop_est(state_fips, county)
 
 
 def send_email_win_outlook(xlsx_files):
+    # Outlook via pywin32; optional, Windows only
+    try:
+        import win32com.client
+    except ImportError:
+        print(" -- no email sent, Outlook requires pywin32 (Windows)")
+        return
+
     olMailItem = 0x0
     today = date.today().strftime("%m/%d")
     obj = win32com.client.Dispatch("Outlook.Application")
@@ -1382,47 +3653,62 @@ def send_email_win_outlook(xlsx_files):
     daily_email.Display(True)
 
 
+# send-email-client => function(xlsx_files); each imports its client library when called
+# todo: unix/osx Mail/win Mail
+g_email_backends = {"Outlook": send_email_win_outlook}
+
+
 def send_email(xlsx_files):
     # Only send if email flag is True:
     if not g_email:
         print(" -- no email sent per conf.json ")
         return
 
-    # Todo, enum?
-    # todo: unix/osx Mail/win Mail
-    if g_email_client == "Outlook":
-        send_email_win_outlook(xlsx_files)
-    else:
+    if len(xlsx_files) == 0:
+        print(" -- no email sent, no xlsx files to attach")
+        return
+
+    if g_email_client not in g_email_backends:
         print(" -- no email sent, unrecognized email client: %s " %
               (g_email_client))
+        return
+    g_email_backends[g_email_client](xlsx_files)
 
 
-if __name__ == "__main__":
+##########
+## Stages #####################################################################
+# Each step of the daily run; __main__ times them, as does covid19_benchmark.py
 
-    br()
-    t_main = log_start('Start daily covid19 processing.')
 
-    br()
-    load_configuration()
-    update_data()
-    cache_active_to_inactive_date_map()
+def ingest_covid19_data(s, c):
+    # columnar ingest returns its (county, state) Covid19Matrix
+    g_location_memo.clear()
+    if g_ingest_engine == "object":
+        if len(g_days_sweep) > 0:
+            print(" (case-days-duration-sweep requires columnar ingest, ignored)", end='')
+        set_county_covid19_cases(s, c)
+        return None
+    return set_county_covid19_cases_columnar(s, c)
 
-    br()
-    t = log_start("Load geography")
-    s = States()
-    c = Counties(s)
-    set_county_population(s, c)
-    validate_custom_geographies(s, c)
-    log_end(t)
 
-    br()
-    t = log_start("Process covid data")
-    set_county_covid19_cases(s, c)
-    log_end(t)
+def get_model_settings():
+    # settings a columnar model's active cases & metrics are computed with
+    return (g_days, tuple(g_days_sweep), tuple(g_rolling_windows), g_per_county, g_per_state)
 
-    br()
-    t = log_start("Extract sheet data")
 
+def set_model_settings(matrices, model_settings):
+    # recompute active cases & metrics when the current settings differ from model_settings,
+    # those matrices were computed with; returns the settings matrices now have
+    if matrices is None or get_model_settings() == model_settings:
+        return model_settings
+    for matrix in matrices:
+        matrix.calc_active(g_days, g_days_sweep)
+        Covid19Metrics(matrix).calc()
+    return get_model_settings()
+
+
+def get_xlsx_jobs(s, c):
+    # [(locations, xlsx filename, XLSX class)] for every spreadsheet in the configuration
     state_data = dict()
     custom_data = dict()
 
@@ -1440,31 +3726,337 @@ if __name__ == "__main__":
             else:
                 custom_data[custom_xlsx].append(get_county_id(s, c, geography))
 
-    log_end(t)
-
-    br()
-
-    t = log_start("Generate xlsx")
-    xlsx_files = []
+    xlsx_jobs = []
 
     for xlsx_fn in custom_data.keys():
-        xlsx_files.append(XLSX(custom_data[xlsx_fn], filename=xlsx_fn))
+        xlsx_jobs.append((custom_data[xlsx_fn], xlsx_fn, XLSX))
 
     # Generate US xlsx?
     if get_global_conf('spreadsheets', 'us', False):
         all_states = s.get_all_states()
-        xlsx_files.append(XLSX(all_states, filename="US"))
+        xlsx_jobs.append((all_states, "US", XLSX))
+
+    # Generate US counties xlsx?
+    if get_global_conf('spreadsheets', 'us-counties', False):
+        all_counties = [county for state in s.get_all_states() for county in state.get_all_counties()]
+        xlsx_jobs.append((all_counties, "us-counties", USCountiesXLSX))
 
     # Generate state XLSX?
     for state_abbr in state_data.keys():
-        xlsx_files.append(XLSX(state_data[state_abbr], filename=state_abbr))
+        xlsx_jobs.append((state_data[state_abbr], state_abbr, XLSX))
+
+    return xlsx_jobs
+
+
+###########
+## Service ####################################################################
+
+# --serve keeps States / Counties and the covid19 matrices loaded, and generates xlsx files on
+# request:
+#   GET  /      - JSON status: NYT data revision, load time, model settings
+#   POST /xlsx  - body is a configuration, as covid19_data_gather_conf.json; the response is its
+#                 xlsx file, or a zip of them when it has several spreadsheets
+#
+# A posted configuration's "spreadsheets" are generated as-is; of its "settings", only
+# g_serve_settings apply - data sync, ingest and email come from the service's configuration.
+# NYT data is ingested without IngestFilter, so any spreadsheet can be served.
+#
+# Every --refresh minutes a background thread runs update_data(); when the NYT checkout changed,
+# the data is re-ingested (Covid19Store parses only new rows).  Sync and re-ingest hold the same
+# lock as requests, so they run between requests.
+#
+# Requests are handled one at a time; --jobs still spreads a request's xlsx files over processes.
+# Those are forked while the lock is held, so the refresh thread is idle - sleeping or waiting.
+
+g_serve_settings = ['case-min-benchmark', 'case-days-duration', 'case-days-duration-sweep', 'case-rolling-windows',
+                    'geography-per-county', 'geography-per-state', 'xlsx-write-only',
+                    'xlsx-chart-series']
+
+g_xlsx_mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+g_serve_sheet_name = re.compile(r"^[A-Za-z0-9_ -]+$")  # posted custom spreadsheet names
+
 
+class Covid19Service:
+    def __init__(self):
+        import threading
+        self.conf = g_conf  # service configuration
+        self.lock = threading.Lock()  # held while the model is read or replaced
+        self.states = None
+        self.counties = None
+        self.matrices = None
+        self.model_settings = None  # settings matrices' active cases & metrics were computed with
+        self.memo_settings = None  # settings of g_location_memo's entries
+        self.revision = None  # NYT data revision ingested, see get_data_revision()
+        self.loaded = None
+
+    def set_globals(self, conf):
+        global g_conf
+        global g_ingest_pushdown
+        global g_xlsx_reuse
+        global g_email
+        g_conf = conf
+        assign_global_vars()
+        g_ingest_pushdown = False
+        g_xlsx_reuse = False
+        g_email = False
+
+    def load(self):
+        # (re-)ingest NYT data; caller holds self.lock, except at startup
+        if self.states is None:
+            (self.states, self.counties) = load_geography()
+        self.revision = get_data_revision()
+        self.matrices = ingest_covid19_data(self.states, self.counties)
+        self.model_settings = get_model_settings()
+        self.loaded = datetime.now()
+
+    def refresh(self):
+        while True:
+            time.sleep(g_serve_refresh * 60)
+            try:
+                # git sync reads g_nyt_* settings, and prints - never alongside a request
+                with self.lock:
+                    self.set_globals(self.conf)
+                    update_data()
+                    if get_data_revision() == self.revision:
+                        continue
+                    t = log_start("Refresh covid data")
+                    self.load()
+                    log_end(t)
+            except Exception as e:
+                print("Refresh failed: %s" % (e), flush=True)
+            except SystemExit as e:
+                # abort() - eg offline, and the NYT checkout is gone; keep serving what is loaded
+                print("Refresh failed: aborted (exit status %s)." % (e.code), flush=True)
+
+    def get_request_conf(self, posted):
+        # service settings, overridden by the posted g_serve_settings
+        conf = dict(posted)
+        conf['settings'] = dict(self.conf['settings'])
+        for (setting, value) in posted.get('settings', dict()).items():
+            if setting in g_serve_settings:
+                conf['settings'][setting] = value
+        return conf
+
+    def validate_sheet_names(self, file):
+        # posted names become xlsx filenames on this host - keep them plain
+        has_err = False
+        for custom_xlsx in g_conf.get('spreadsheets', dict()).get('custom', dict()):
+            if not g_serve_sheet_name.match(custom_xlsx):
+                print(file=file)
+                print(file=file)
+                print(f"Error - Invalid spreadsheet name in {g_json_path}", file=file)
+                print(f"        -> spreadsheets.custom.{custom_xlsx} <-", file=file)
+                print("        Posted spreadsheet names may only use letters, digits, space, _ and -", file=file)
+                print(file=file)
+                has_err = True
+        if has_err:
+            print(f"Please update {g_json_path} and try again!", file=file)
+            abort(file)
+
+    def get_status(self):
+        with self.lock:
+            return {'data': self.revision, 'loaded': self.loaded.isoformat(timespec='seconds'),
+                    'settings': dict(zip(['case-days-duration', 'case-days-duration-sweep', 'case-rolling-windows',
+                                          'geography-per-county', 'geography-per-state'], self.model_settings)),
+                    'states': len(self.states.states_by_name), 'counties': len(self.counties.counties_by_fips)}
+
+    def gen_xlsx(self, posted):
+        # (http status, [xlsx file path] or error text, temporary directory holding the xlsx files
+        # or None) - the caller removes the directory
+        global g_json_path
+        global g_xlsx_path
+
+        with self.lock:
+            json_path = g_json_path
+            xlsx_path = g_xlsx_path
+            try:
+                # same validation, and error text, as a configuration file
+                g_json_path = "posted configuration"
+                import io
+                out = io.StringIO()
+                try:
+                    self.set_globals(self.get_request_conf(posted))
+                    validate_json(out)
+                    self.validate_sheet_names(out)
+                    validate_custom_geographies(self.states, self.counties, out)
+                except SystemExit:
+                    return (400, out.getvalue(), None)
+
+                xlsx_jobs = get_xlsx_jobs(self.states, self.counties)
+                if len(xlsx_jobs) == 0:
+                    return (400, "No spreadsheets configured.", None)
+                self.model_settings = set_model_settings(self.matrices, self.model_settings)
+                # keep one settings' worth of memo, not one per setting ever posted
+                memo_settings = (g_case_benchmark, get_model_settings())
+                if memo_settings != self.memo_settings:
+                    g_location_memo.clear()
+                    self.memo_settings = memo_settings
+
+                import tempfile
+                g_xlsx_path = Path(tempfile.mkdtemp(prefix="covid19_xlsx_"))
+                try:
+                    xlsx_files = gen_xlsx_files(xlsx_jobs, g_jobs)
+                except BaseException:
+                    shutil.rmtree(g_xlsx_path, ignore_errors=True)
+                    raise
+                return (200, [xlsx_file.wb_file for xlsx_file in xlsx_files], g_xlsx_path)
+            finally:
+                g_json_path = json_path
+                g_xlsx_path = xlsx_path
+                self.set_globals(self.conf)
+
+    def serve_forever(self):
+        self.set_globals(self.conf)
+        if g_ingest_engine == "object":
+            print("--serve requires columnar ingest (\"ingest-engine\": \"columnar\")")
+            abort()
+
+        br()
+        with ProfileStage("Update data"):
+            update_data()
+        br()
+        t = log_start("Load geography & covid data")
+        with ProfileStage("Load geography & covid data"):
+            self.load()
+        log_end(t)
+
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        handler = type("Covid19ServiceHTTPHandler", (Covid19ServiceHandler, BaseHTTPRequestHandler), dict())
+        import threading
+        threading.Thread(target=self.refresh, daemon=True).start()
+        server = HTTPServer(g_serve_address, handler)
+        server.service = self
+        br()
+        print("Serving on http://%s:%i/ - POST a configuration to /xlsx" % (server.server_address[:2]), flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+
+
+class Covid19ServiceHandler:
+    # request handling, mixed into http.server's BaseHTTPRequestHandler by serve_forever()
+
+    def send(self, status, content_type, body, filename=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if filename is not None:
+            self.send_header("Content-Disposition", 'attachment; filename="%s"' % (filename))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text):
+        self.send(status, "text/plain; charset=utf-8", text.encode())
+
+    def do_GET(self):
+        if self.path != "/":
+            return self.send_text(404, "Not found.")
+        self.send(200, "application/json", json.dumps(self.server.service.get_status(), indent=4).encode())
+
+    def do_POST(self):
+        if self.path != "/xlsx":
+            return self.send_text(404, "Not found.")
+        try:
+            posted = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            return self.send_text(400, "Invalid JSON: %s" % (e))
+        if not isinstance(posted, dict):
+            return self.send_text(400, "Expected a configuration object.")
+
+        try:
+            (status, result, xlsx_dir) = self.server.service.gen_xlsx(posted)
+        except Exception as e:
+            return self.send_text(500, "Unable to generate xlsx: %s" % (e))
+        if status != 200:
+            return self.send_text(status, result)
+
+        try:
+            if len(result) == 1:
+                with open(result[0], 'rb') as f:
+                    return self.send(200, g_xlsx_mime_type, f.read(), os.path.basename(result[0]))
+            import io
+            import zipfile
+            body = io.BytesIO()
+            with zipfile.ZipFile(body, 'w') as z:
+                for wb_file in result:
+                    z.write(wb_file, os.path.basename(wb_file))
+            self.send(200, "application/zip", body.getvalue(), "covid19_%s_data.zip" % (date.today().strftime("%Y_%m_%d")))
+        finally:
+            shutil.rmtree(xlsx_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+
+    parse_command_line()
+
+    br()
+    t_main = log_start('Start daily covid19 processing.')
+
+    br()
+    with ProfileStage("Load settings"):
+        load_configuration()
+
+    if g_serve_address is not None:
+        Covid19Service().serve_forever()
+        exit(0)
+    with ProfileStage("Update data"):
+        update_data()
+
+    br()
+    t = log_start("Load geography")
+    with ProfileStage("Load geography"):
+        (s, c) = load_geography()
+        for (conf_path, conf) in g_confs:
+            set_configuration(conf_path, conf)
+            validate_custom_geographies(s, c)
+        set_configuration(*g_confs[0])
     log_end(t)
 
     br()
-    t = log_start("Send email")
-    send_email(xlsx_files)
+    t = log_start("Process covid data")
+    with ProfileStage("Process covid data"):
+        matrices = ingest_covid19_data(s, c)
     log_end(t)
+    model_settings = get_model_settings()
+
+    for (conf_path, conf) in g_confs:
+        # batch mode: each configuration's stages are named after it
+        stage = "" if len(g_confs) == 1 else " - %s" % (Path(conf_path).stem)
+        set_configuration(conf_path, conf)
+
+        br()
+        t = log_start("Extract sheet data" + stage)
+        with ProfileStage("Extract sheet data" + stage):
+            model_settings = set_model_settings(matrices, model_settings)
+            xlsx_jobs = get_xlsx_jobs(s, c)
+        log_end(t)
+
+        br()
+
+        xlsx_files = []
+        if "xlsx" in g_export_formats:
+            t = log_start("Generate xlsx" + stage)
+            with ProfileStage("Generate xlsx" + stage):
+                xlsx_files = gen_xlsx_files(xlsx_jobs, g_jobs)
+            log_end(t)
+
+        if len(set(g_export_formats) - set(["xlsx"])) > 0:
+            br()
+            t = log_start("Export data" + stage)
+            with ProfileStage("Export data" + stage):
+                gen_export_files(xlsx_jobs)
+            log_end(t)
+
+        br()
+        t = log_start("Send email" + stage)
+        with ProfileStage("Send email" + stage):
+            send_email(xlsx_files)
+        log_end(t)
+
+    write_trace()
 
     br()
     log_start('All done!')